@@ -0,0 +1,355 @@
+# python_server/benchmark.py
+# 既知の対数螺旋に沿って物体を置いた合成画像で、速度とあてはめ精度を測る
+#   python benchmark.py -o bench.json                     # 全ケースを実行
+#   python benchmark.py --quick -o bench.json --compare baseline.json
+#   python benchmark.py --cold-start -o cold.json         # import 時間と初回レスポンスまでの時間
+#   python benchmark.py --quick --measure-memory [--memory-lean]  # 1リクエストあたりのメモリのピークも測る
+# 乱数はすべて固定シードなので、同じマシン・同じコードなら精度の値は毎回同じになる
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import itertools
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from main import run_analysis_pipeline, analysis_task, build_analysis_response, ANALYSIS_MAX_DIM, DISPLAY_MAX_DIM, SCORE_TARGETS
+from spiral_fit import calculate_composition_score, SCORING_METRICS
+from optimizers import OPTIMIZERS
+from instrumentation import StageTimer
+
+# --- 合成画像の条件 (全組み合わせを実行する) ---
+RESOLUTIONS = ((800, 600), (1920, 1280), (4000, 3000))
+OBJECT_COUNTS = (6, 15, 40)
+# ノイズ: 位置の揺らぎ (物体半径に対する標準偏差)・螺旋と無関係な物体の割合・画素ノイズの強さを同時に上げる
+NOISE_LEVELS = (0.0, 0.5)
+B_VALUES = (0.2, 0.30635, 0.45)
+# --quick で使う縮小版
+QUICK_RESOLUTIONS = ((800, 600), (1920, 1280))
+QUICK_OBJECT_COUNTS = (6, 15)
+QUICK_B_VALUES = (0.2, 0.30635)
+# 植える螺旋の向き。-1 のケースは同じシードの +1 のケースの鏡像 (id の末尾に -mirrored を付ける)
+CHIRALITIES = (1, -1)
+
+# 螺旋の置き方: 極は画像中央付近、物体は半径が短辺の RADIUS_RANGE 倍の範囲に並べる
+SPIRAL_A_RATIO = 0.1
+RADIUS_RANGE = (0.05, 0.45)
+BLOB_RADIUS_RATIO = 0.012
+MIN_BLOB_RADIUS = 5
+
+# --compare で劣化とみなす閾値
+LATENCY_TOLERANCE = 1.25     # 所要時間の中央値がこの倍率を超えたら劣化
+B_ERROR_TOLERANCE = 0.02     # b の誤差の平均がこれ以上増えたら劣化
+FIT_DISTANCE_TOLERANCE = 0.5  # 植えた点までの平均距離 (画素) がこれ以上増えたら劣化
+
+
+def planted_spiral(width, height, b, rng, chirality=1):
+    """画像中央付近に極を置いた螺旋のパラメータ"""
+    short_side = min(width, height)
+    return {
+        "cx": width * rng.uniform(0.4, 0.6),
+        "cy": height * rng.uniform(0.4, 0.6),
+        "a": SPIRAL_A_RATIO * short_side,
+        "b": b,
+        "rotation": 0.0,
+        "chirality": float(chirality),
+    }
+
+
+def make_image(width, height, n_objects, noise, b, seed, chirality=1):
+    """
+    螺旋に沿って n_objects 個の円を描いた画像を作る (chirality=-1 なら螺旋を上下に反転した向きで置く)。
+    戻り値は (BGR 画像, 植えた螺旋のパラメータ, 螺旋上に植えた物体の中心 (n×2))。
+    """
+    rng = np.random.default_rng(seed)
+    params = planted_spiral(width, height, b, rng, chirality)
+    short_side = min(width, height)
+    radius = max(MIN_BLOB_RADIUS, int(round(BLOB_RADIUS_RATIO * short_side)))
+
+    # 半径が RADIUS_RANGE に収まる θ の区間に等間隔で並べる
+    theta_min, theta_max = (np.log(ratio * short_side / params["a"]) / b for ratio in RADIUS_RANGE)
+    theta = np.linspace(theta_min, theta_max, n_objects)
+    r = params["a"] * np.exp(b * theta)
+    centers = np.column_stack((params["cx"] + r * np.cos(theta), params["cy"] + chirality * r * np.sin(theta)))
+    centers += rng.normal(0, noise * radius, size=centers.shape)
+
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    for x, y in centers:
+        cv2.circle(image, (int(round(x)), int(round(y))), radius, (40, 40, 40), -1)
+    # 螺旋と無関係な物体
+    for x, y in rng.uniform((radius, radius), (width - radius, height - radius), size=(int(round(noise * n_objects)), 2)):
+        cv2.circle(image, (int(x), int(y)), radius, (40, 40, 40), -1)
+    if noise > 0:
+        grain = rng.normal(0, 10 * noise, size=image.shape)
+        image = np.clip(image + grain, 0, 255).astype(np.uint8)
+    return image, params, centers
+
+
+def recovery_errors(found, planted, centers, image_shape):
+    """
+    見つかった螺旋と植えた螺旋の差。
+    a は回転と区別できない (θ を 2π ずらすと a が e^{2πb} 倍になる) ので、回転 0 に換算した
+    log a (log a - chirality·b·rotation) の差を 2πb で割った余りで測る。
+    """
+    if not found:
+        return {"pole_error": None, "b_error": None, "log_a_error": None, "chirality_correct": None,
+                "fit_distance": None, "planted_fit_distance": None}
+    h, w = image_shape
+    period = 2 * np.pi * planted["b"]
+    log_a_diff = np.log(found["a"] / planted["a"]) - found["chirality"] * found["b"] * found["rotation"]
+    return {
+        # 極のずれ (画像の対角線に対する割合)
+        "pole_error": float(np.hypot(found["cx"] - planted["cx"], found["cy"] - planted["cy"]) / np.hypot(w, h)),
+        "b_error": float(abs(found["b"] - planted["b"])),
+        "log_a_error": float(abs((log_a_diff + period / 2) % period - period / 2)),
+        "chirality_correct": found["chirality"] == planted["chirality"],
+        # 植えた物体の中心から見つかった螺旋までの平均距離 (calculate_composition_score)。
+        # 植えた螺旋そのものでも θ のサンプリングと位置の揺らぎの分だけ 0 にはならないので、その値も並べる
+        "fit_distance": float(calculate_composition_score(found, centers, image_shape)),
+        "planted_fit_distance": float(calculate_composition_score(planted, centers, image_shape)),
+    }
+
+
+def _body_size(response):
+    if isinstance(response, StreamingResponse):
+        async def consume():
+            return sum([len(chunk) async for chunk in response.body_iterator])
+        return asyncio.run(consume())
+    return len(response.body)
+
+
+def measure_peak_memory(image_bytes, options):
+    """
+    /analyze/ の1リクエスト分 (ワーカーでの分析からレスポンス本文を送り終えるまで) のメモリのピーク (バイト)。
+    tracemalloc で測るので Python と NumPy の確保だけを数え、OpenCV 内部の一時領域は含まない。
+    アップロードのバイト列は計測前に確保されているので、その大きさを足して返す。
+    """
+    tracemalloc.start()
+    try:
+        result, _, _ = analysis_task(image_bytes, None, **options)
+        _body_size(build_analysis_response(result, options.get("response_format", "base64")))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak + len(image_bytes)
+
+
+def run_case(case, options, repeat, measure_memory=False):
+    image, planted, centers = make_image(case["width"], case["height"], case["objects"], case["noise"], case["b"], case["seed"],
+                                         case["chirality"])
+    _, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    image_bytes = encoded.tobytes()
+
+    runs = []
+    for _ in range(repeat):
+        timer = StageTimer()
+        started = time.perf_counter()
+        try:
+            result = run_analysis_pipeline(image_bytes, timer=timer, **options)
+        except HTTPException as e:
+            return {**case, "error": e.detail}
+        runs.append((time.perf_counter() - started, timer.stages, result))
+
+    # 時間は中央値、精度は1回目の結果で測る (seed 固定なら毎回同じ)
+    result = runs[0][2]
+    memory = {"peak_memory_bytes": measure_peak_memory(image_bytes, options)} if measure_memory else {}
+    # 結果は表示用の解像度 (長辺 DISPLAY_MAX_DIM) の座標なので、植えた側の座標に戻して比べる
+    scale = max(1.0, max(case["width"], case["height"]) / DISPLAY_MAX_DIM)
+    found = {name: value * scale if name in ("cx", "cy", "a") else value for name, value in result["spiral"].items()}
+    stage_names = sorted(set().union(*(stages for _, stages, _ in runs)))
+    return {
+        **case,
+        "seconds": float(np.median([total for total, _, _ in runs])),
+        "stages": {name: float(np.median([stages.get(name, 0.0) for _, stages, _ in runs])) for name in stage_names},
+        "score": result["score"],
+        "k": result["search"].get("k"),
+        "evaluations": result["search"]["evaluations"],
+        "stop_reason": result["search"]["stop_reason"],
+        "planted": planted,
+        "found": found,
+        **recovery_errors(found, planted, centers, (case["height"], case["width"])),
+        **memory,
+    }
+
+
+def build_cases(quick, seed):
+    resolutions = QUICK_RESOLUTIONS if quick else RESOLUTIONS
+    object_counts = QUICK_OBJECT_COUNTS if quick else OBJECT_COUNTS
+    b_values = QUICK_B_VALUES if quick else B_VALUES
+    cases = []
+    for chirality in CHIRALITIES:
+        for i, ((width, height), n_objects, noise, b) in enumerate(itertools.product(resolutions, object_counts, NOISE_LEVELS, b_values)):
+            suffix = "" if chirality == 1 else "-mirrored"
+            cases.append({"id": f"{width}x{height}-n{n_objects}-noise{noise}-b{b}{suffix}", "width": width, "height": height,
+                          "objects": n_objects, "noise": noise, "b": b, "chirality": chirality, "seed": seed + i})
+    return cases
+
+
+def summarize(results):
+    ok = [r for r in results if "error" not in r]
+    recovered = [r for r in ok if r["b_error"] is not None]
+
+    def mean(key):
+        return float(np.mean([r[key] for r in recovered])) if recovered else None
+
+    stage_names = sorted(set().union(*(r["stages"] for r in ok))) if ok else []
+    return {
+        "cases": len(results),
+        "errors": len(results) - len(ok),
+        "median_seconds": float(np.median([r["seconds"] for r in ok])) if ok else None,
+        "median_stage_seconds": {name: float(np.median([r["stages"].get(name, 0.0) for r in ok])) for name in stage_names},
+        "mean_b_error": mean("b_error"),
+        "mean_pole_error": mean("pole_error"),
+        "mean_log_a_error": mean("log_a_error"),
+        "mean_fit_distance": mean("fit_distance"),
+        "mean_planted_fit_distance": mean("planted_fit_distance"),
+        # 植えた向きと同じ向きの螺旋が見つかったケースの割合
+        "chirality_accuracy": mean("chirality_correct"),
+        "mean_score": float(np.mean([r["score"] for r in ok])) if ok else None,
+        "max_peak_memory_bytes": max((r["peak_memory_bytes"] for r in ok if "peak_memory_bytes" in r), default=None),
+    }
+
+
+def compare(current, baseline):
+    """
+    前回の結果 (同じケース id) と比べて劣化したケースを列挙する。
+    所要時間は LATENCY_TOLERANCE 倍、精度は B_ERROR_TOLERANCE / FIT_DISTANCE_TOLERANCE を超えたら劣化とみなす。
+    """
+    previous = {r["id"]: r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        old = previous.get(r["id"])
+        if old is None or "error" in old:
+            continue
+        if "error" in r:
+            regressions.append(f"{r['id']}: エラーになった ({r['error']})")
+            continue
+        if r["seconds"] > old["seconds"] * LATENCY_TOLERANCE:
+            regressions.append(f"{r['id']}: 所要時間 {old['seconds']:.3f}s -> {r['seconds']:.3f}s")
+        if old["b_error"] is not None and r["b_error"] > old["b_error"] + B_ERROR_TOLERANCE:
+            regressions.append(f"{r['id']}: b の誤差 {old['b_error']:.4f} -> {r['b_error']:.4f}")
+        if old["fit_distance"] is not None and r["fit_distance"] > old["fit_distance"] + FIT_DISTANCE_TOLERANCE:
+            regressions.append(f"{r['id']}: 植えた点までの距離 {old['fit_distance']:.2f} -> {r['fit_distance']:.2f}")
+        if old.get("chirality_correct") and not r["chirality_correct"]:
+            regressions.append(f"{r['id']}: 螺旋の向きを取り違えた")
+    return regressions
+
+
+# ★★★ コールドスタートの計測 ★★★
+# 新しいプロセスで main を import し、(WARM_UP=1 ならウォームアップしてから) 1回目と2回目の分析の時間を測る
+COLD_START_SCRIPT = """
+import sys, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+heavy_modules = [name for name in ("sklearn", "matplotlib") if name in sys.modules]
+if sys.argv[1] == "1":
+    main.warm_up()
+ready = time.perf_counter()
+import cv2
+from benchmark import make_image
+image, _, _ = make_image(1920, 1280, 15, 0.0, 0.30635, 0)
+image_bytes = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+responses = []
+for seed in (0, 1):
+    request_started = time.perf_counter()
+    main.run_analysis_pipeline(image_bytes, k=0, b_weight=100.0, seed=seed, response_format="vector")
+    responses.append(time.perf_counter() - request_started)
+print(json.dumps({"import_seconds": imported - started, "warm_up_seconds": ready - imported,
+                  "first_response_seconds": responses[0], "second_response_seconds": responses[1],
+                  "time_to_first_response": ready - started + responses[0],
+                  "heavy_modules_loaded_at_import": heavy_modules}))
+"""
+
+
+def cold_start_report(repeat):
+    """ウォームアップの有無それぞれについて、repeat 個の新しいプロセスで測った値の中央値を返す"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    report = {}
+    for warm in (False, True):
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT, "1" if warm else "0"], cwd=here,
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        report["warm_up" if warm else "no_warm_up"] = {
+            **{key: float(np.median([run[key] for run in runs])) for key in runs[0] if key.endswith("seconds") or key.startswith("time")},
+            "heavy_modules_loaded_at_import": runs[0]["heavy_modules_loaded_at_import"],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成画像による速度・精度のベンチマーク")
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--quick", action="store_true", help="条件を減らした短い版を実行する")
+    parser.add_argument("--repeat", type=int, default=3, help="各ケースの実行回数 (時間は中央値を使う)")
+    parser.add_argument("--seed", type=int, default=0, help="画像生成と探索の乱数シード")
+    parser.add_argument("--optimizer", choices=sorted(OPTIMIZERS), default="ga")
+    parser.add_argument("--metric", choices=sorted(SCORING_METRICS), default="sampled")
+    parser.add_argument("--analysis-max-dim", type=int, default=ANALYSIS_MAX_DIM)
+    parser.add_argument("--score-target", choices=SCORE_TARGETS, default="clustered", help="螺旋の採点に使う点")
+    parser.add_argument("--compare", default=None, help="前回の出力と比べ、劣化があれば終了コード 1 で終わる")
+    parser.add_argument("--memory-lean", action="store_true", help="memory_lean (直接描画・base64 の逐次送信) で分析する")
+    parser.add_argument("--measure-memory", action="store_true", help="各ケースでもう1回実行し、1リクエストあたりのメモリのピークを測る")
+    parser.add_argument("--cold-start", action="store_true", help="合成画像のケースの代わりに import 時間と初回レスポンスまでの時間を測る")
+    args = parser.parse_args()
+
+    if args.cold_start:
+        report = {
+            "meta": {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"), "python": platform.python_version(),
+                     "platform": platform.platform(), "cpu_count": os.cpu_count(), "repeat": args.repeat},
+            "cold_start": cold_start_report(args.repeat),
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(json.dumps(report["cold_start"], ensure_ascii=False, indent=2), file=sys.stderr)
+        return 0
+
+    options = dict(k=0, b_weight=100.0, metric=args.metric, optimizer=args.optimizer, seed=args.seed,
+                   analysis_max_dim=args.analysis_max_dim, memory_lean=args.memory_lean, score_target=args.score_target)
+    results = []
+    for case in build_cases(args.quick, args.seed):
+        record = run_case(case, options, args.repeat, args.measure_memory)
+        results.append(record)
+        if "error" in record:
+            print(f"{case['id']}: エラー ({record['error']})", file=sys.stderr)
+        else:
+            print(f"{case['id']}: {record['seconds']:.3f}s スコア {record['score']} b誤差 {record['b_error']:.4f} "
+                  f"距離 {record['fit_distance']:.2f} 向き {'正' if record['chirality_correct'] else '誤'}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "options": options, "quick": args.quick, "repeat": args.repeat,
+        },
+        "summary": summarize(results),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report["summary"], ensure_ascii=False, indent=2), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f))
+        for line in regressions:
+            print(f"劣化: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# python_server/cache.py
+
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# --- キャッシュの設定 (環境変数で変更可能) ---
+# FEATURE_CACHE_MAX_BYTES: デコード・リサイズ済み画像と重心を置くメモリ上限
+FEATURE_CACHE_MAX_BYTES = int(os.environ.get("FEATURE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# RESULT_CACHE_MAX_BYTES: 最終結果 (JSON にする dict) を置くメモリ上限
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# CACHE_DIR: 指定すると再起動後も残るディスク層を使う (未指定ならメモリのみ)。
+# ディスク層のファイルは pickle で読み込むので、このディレクトリに書き込める者はサーバー上で任意のコードを実行できる。
+# サーバーのユーザーだけが書き込める (他のユーザーやアップロードと共有しない) ディレクトリを指定すること
+CACHE_DIR = os.environ.get("CACHE_DIR") or None
+# CACHE_DIR_MAX_BYTES: ディスク層 (features / results それぞれ) の上限。超えたら最後に使ったのが古いファイルから消す
+CACHE_DIR_MAX_BYTES = int(os.environ.get("CACHE_DIR_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+def image_digest(image_bytes):
+    """画像のバイト列から内容に基づくキーを作る"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def estimate_size(value):
+    """キャッシュする値のおおよそのバイト数 (NumPy 配列は nbytes、それ以外は中身を辿る)"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 64
+
+
+class LayeredCache:
+    """
+    バイト数で上限を決めた LRU のメモリ層と、任意のディスク層からなるキャッシュ。
+    メモリに無くディスクにあれば読み込んでメモリ層に戻す。ヒット・ミスの回数を数える。
+    ディスク層も disk_max_bytes を上限にし、ファイルの更新時刻 (読み込むたびに更新する) が古いものから消す。
+    """
+
+    def __init__(self, name, max_bytes, disk_dir=CACHE_DIR, disk_max_bytes=CACHE_DIR_MAX_BYTES):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".pkl")
+
+    def _put_memory(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits["memory"] += 1
+                return self._items[key][0]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            if value is not None:
+                self.hits["disk"] += 1
+                self._touch(self._disk_path(key))
+                self._put_memory(key, value, estimate_size(value))
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._put_memory(key, value, estimate_size(value))
+        if self.disk_dir:
+            # 書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+            self._evict_disk()
+
+    def _touch(self, path):
+        # 読み込んだファイルの更新時刻を今にして、ディスク層の追い出しを LRU にする
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """
+        ディスク層の合計が disk_max_bytes を超えていれば、更新時刻の古いファイルから消す。
+        ワーカープロセスが同じディレクトリに書くので、プロセス内で数えずに毎回ディレクトリを調べる。
+        """
+        entries = []
+        try:
+            with os.scandir(self.disk_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".pkl"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        # 他のプロセスが先に消したファイル
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if used <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            used -= size
+
+    def stats(self):
+        with self._lock:
+            entries, used = len(self._items), self._bytes
+        return {"entries": entries, "bytes": used, "max_bytes": self.max_bytes, "disk": bool(self.disk_dir),
+                "disk_max_bytes": self.disk_max_bytes if self.disk_dir else None,
+                "hits_memory": self.hits["memory"], "hits_disk": self.hits["disk"], "misses": self.misses}
+
+
+# 画像ごとの特徴量 (リサイズ済み画像・重心・自動決定した k) と、パラメータごとの最終結果
+feature_cache = LayeredCache("features", FEATURE_CACHE_MAX_BYTES)
+result_cache = LayeredCache("results", RESULT_CACHE_MAX_BYTES)
+
+
+def cache_stats():
+    return {"features": feature_cache.stats(), "results": result_cache.stats()}
@@ -0,0 +1,221 @@
+# python_server/cli.py
+# サーバーを立てずに分析を実行するコマンドラインツール
+#   python cli.py batch <画像ディレクトリ> -o results.jsonl [--overlay-dir overlays] [--workers 4]
+#   python cli.py sequence <動画ファイル または 連写画像のディレクトリ> -o track.jsonl [--frame-step 2]
+
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from fastapi import HTTPException
+
+from main import batch_task, run_sequence_pipeline, AnalysisOptions, EXTRACTION_METHODS, SCORE_TARGETS
+from sequence import TrackSummary, CHANGE_THRESHOLD, SCENE_CUT_THRESHOLD
+from optimizers import OPTIMIZERS
+from spiral_fit import SCORING_METRICS
+from visualization import IMAGE_FORMATS
+from worker_pool import init_worker
+
+# 一括分析の対象にする拡張子
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+
+def find_images(root):
+    """root 以下の画像を再帰的に探し、root からの相対パスを名前順に返す"""
+    names = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                names.append(os.path.relpath(os.path.join(dirpath, filename), root))
+    return names
+
+
+def load_done(output_path):
+    """
+    既存の出力 (JSONL) でスコアまで記録済みの画像名を返す。
+    エラーになった行はやり直すので含めない。中断されて最後の行が書きかけになっている場合は、その行を無視する。
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if "score" in record: done.add(record["file"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+    return done
+
+
+def drop_stale_records(output_path, names):
+    """
+    やり直す画像 (names) の古い記録 (エラーの行) と、中断で書きかけになった行を既存の出力から取り除く。
+    再開しても1枚につき1行だけが残るようにするため。取り除く行が無ければファイルには触らない。
+    """
+    if not os.path.exists(output_path):
+        return
+    names = set(names)
+    kept, dropped = [], False
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                stale = record["file"] in names
+            except (json.JSONDecodeError, KeyError, TypeError):
+                stale = True
+            if stale or not line.endswith("\n"):
+                dropped = True
+            if not stale:
+                kept.append(line if line.endswith("\n") else line + "\n")
+    if not dropped:
+        return
+    # 途中で中断されても元の出力を壊さないよう、一時ファイルに書いてから置き換える
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(kept)
+    os.replace(tmp_path, output_path)
+
+
+def _analyze_file(root, name, overlay_dir, options):
+    """ワーカープロセスで1枚を読み込んで分析する"""
+    overlay_path = None
+    if overlay_dir is not None:
+        ext = IMAGE_FORMATS[options["image_format"]][0]
+        overlay_path = os.path.join(overlay_dir, os.path.splitext(name)[0] + ext)
+        os.makedirs(os.path.dirname(overlay_path) or ".", exist_ok=True)
+    try:
+        with open(os.path.join(root, name), "rb") as f:
+            image_bytes = f.read()
+    except OSError as e:
+        return {"file": name, "error": str(e), "status_code": 400}
+    return batch_task(image_bytes, name, overlay_path, **options)
+
+
+def analysis_options(args):
+    """add_analysis_arguments の引数を AnalysisOptions にまとめる"""
+    return AnalysisOptions(k=args.k, b_weight=args.b_weight, metric=args.metric, latency_budget=args.latency_budget,
+                           optimizer=args.optimizer, seed=args.seed, warm_start=not args.no_warm_start, extraction=args.extraction,
+                           area_weighted=args.area_weighted, score_target=args.score_target, analysis_max_dim=args.analysis_max_dim)
+
+
+def run_batch(args):
+    options = dict(analysis_options(args).as_dict(), image_format=args.image_format, image_quality=args.image_quality)
+    names = find_images(args.input_dir)
+    done = load_done(args.output)
+    pending = [name for name in names if name not in done]
+    print(f"{len(names)} 枚中 {len(names) - len(pending)} 枚は出力済みのためスキップします。", file=sys.stderr)
+    if not pending:
+        return 0
+    drop_stale_records(args.output, pending)
+
+    workers = args.workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker)
+    failed = 0
+    with executor, open(args.output, "a", encoding="utf-8") as out:
+        queue = iter(pending)
+        running = set()
+        finished = 0
+        while True:
+            # 一度に投入するのはワーカー数の2倍まで (数万枚でも未処理のジョブを溜め込まない)
+            for name in queue:
+                running.add(executor.submit(_analyze_file, args.input_dir, name, args.overlay_dir, options))
+                if len(running) >= workers * 2: break
+            if not running:
+                break
+            completed, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                record = future.result()
+                # 1行ずつ書き出して flush し、中断されてもそこまでの結果は残す
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                finished += 1
+                if "error" in record:
+                    failed += 1
+                    print(f"[{finished}/{len(pending)}] {record['file']}: エラー ({record['error']})", file=sys.stderr)
+                else:
+                    print(f"[{finished}/{len(pending)}] {record['file']}: スコア {record['score']} (b={record['b_value']})", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_sequence(args):
+    """
+    動画かディレクトリ内の画像 (名前順) を1フレームずつ分析し、1フレーム1行の JSONL に書き出す。
+    最後の行は {"event": "summary", ...}。フレームは1枚ずつ読むので、長い動画でもメモリは一定。
+    """
+    options = dict(analysis_options(args).as_dict(), change_threshold=args.change_threshold,
+                   scene_cut_threshold=args.scene_cut_threshold, frame_step=args.frame_step)
+    if os.path.isdir(args.input):
+        paths = [os.path.join(args.input, name) for name in find_images(args.input)]
+    else:
+        paths = [args.input]
+    summary = TrackSummary()
+    with open(args.output, "w", encoding="utf-8") as out:
+        try:
+            for record in run_sequence_pipeline(paths, **options):
+                summary.add(record)
+                out.write(json.dumps({"event": "frame", **record}, ensure_ascii=False) + "\n")
+                out.flush()
+                if "error" in record:
+                    print(f"フレーム {record['frame']}: エラー ({record['error']})", file=sys.stderr)
+                else:
+                    print(f"フレーム {record['frame']}: スコア {record['score']} (b={record['b_value']}, "
+                          f"{'再抽出' if record['reextracted'] else '重心を再利用'})", file=sys.stderr)
+        except HTTPException as e:
+            print(f"エラー: {e.detail}", file=sys.stderr)
+            return 1
+        out.write(json.dumps({"event": "summary", **summary.as_dict()}, ensure_ascii=False) + "\n")
+    print(json.dumps(summary.as_dict(), ensure_ascii=False), file=sys.stderr)
+    return 0
+
+
+def add_analysis_arguments(parser):
+    """/analyze/ と同じ分析パラメータ"""
+    parser.add_argument("--k", type=int, default=0, help="クラスタ数 (0 ならエルボー法で自動決定)")
+    parser.add_argument("--b-weight", type=float, default=100.0)
+    parser.add_argument("--metric", choices=sorted(SCORING_METRICS), default="sampled")
+    parser.add_argument("--latency-budget", type=float, default=0.0, help="1枚あたりの探索時間の上限 (秒, 0 なら無制限)")
+    parser.add_argument("--optimizer", choices=sorted(OPTIMIZERS), default="ga")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-warm-start", action="store_true")
+    parser.add_argument("--extraction", choices=EXTRACTION_METHODS, default="components")
+    parser.add_argument("--area-weighted", action="store_true")
+    parser.add_argument("--score-target", choices=SCORE_TARGETS, default="clustered",
+                        help="螺旋の採点に使う点 (raw ならクラスタリングせず、抽出したすべての重心で採点する)")
+    parser.add_argument("--analysis-max-dim", type=int, default=AnalysisOptions.analysis_max_dim)
+    parser.add_argument("--image-format", choices=sorted(IMAGE_FORMATS), default="png", help="描画結果の保存形式")
+    parser.add_argument("--image-quality", type=int, default=90)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="フィボナッチ螺旋の構図分析 (コマンドライン版)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser("batch", help="ディレクトリ内の画像をまとめて分析し、1枚1行の JSONL に書き出す")
+    batch.add_argument("input_dir")
+    batch.add_argument("-o", "--output", required=True, help="出力先の JSONL (スコアを記録済みの画像はスキップし、エラーだった画像は古い行を消してやり直す)")
+    batch.add_argument("--overlay-dir", default=None, help="指定すると描画結果をここに保存する")
+    batch.add_argument("--workers", type=int, default=0, help="ワーカープロセス数 (0 なら CPU 数)")
+    add_analysis_arguments(batch)
+    batch.set_defaults(func=run_batch)
+
+    sequence = subparsers.add_parser("sequence", help="動画や連写画像を1フレームずつ分析し、スコアの推移を JSONL に書き出す")
+    sequence.add_argument("input", help="動画ファイル、または連写画像のディレクトリ (名前順に1枚1フレーム)")
+    sequence.add_argument("-o", "--output", required=True, help="出力先の JSONL (1フレーム1行 + 最後に集計)")
+    sequence.add_argument("--change-threshold", type=float, default=CHANGE_THRESHOLD,
+                          help="最後に重心を抽出したフレームとの差 (0〜1) がこれを超えたら抽出し直す")
+    sequence.add_argument("--scene-cut-threshold", type=float, default=SCENE_CUT_THRESHOLD,
+                          help="フレームの差がこれを超えたら前の螺旋を引き継がずに探索し直す")
+    sequence.add_argument("--frame-step", type=int, default=1, help="このフレーム数ごとに1枚だけ分析する")
+    add_analysis_arguments(sequence)
+    sequence.set_defaults(func=run_sequence)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,202 @@
+# python_server/instrumentation.py
+
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+from cache import cache_stats
+from worker_pool import pool_status
+
+# --- ログの設定 (環境変数で変更可能) ---
+# LOG_LEVEL: DEBUG にすると探索の世代ごとの途中経過なども出力する
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# LOG_FORMAT: "json" なら1行1件の JSON、それ以外は "メッセージ key=value ..." の形式
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+
+class _FieldsFormatter(logging.Formatter):
+    """logger.debug(..., extra={"fields": {...}}) で渡した項目を出力に含める"""
+
+    def __init__(self, json_output):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if self.json_output:
+            entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage(), **fields}
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        return super().format(record) + "".join(f" {key}={value}" for key, value in fields.items())
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """ルートロガーにハンドラを1つだけ設定する (ワーカープロセスでも同じ設定になる)"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(_FieldsFormatter(log_format == "json"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # Pillow は DEBUG で画像のチャンクごとにログを出すので抑える
+    logging.getLogger("PIL").setLevel(max(logging.INFO, root.level))
+
+
+# ★★★ 処理段階ごとの所要時間を測る ★★★
+class StageTimer:
+    """
+    with timer.stage("decode"): ... のように囲んだ区間の秒数を段階名ごとに積算する。
+    中身は dict だけなので、ワーカープロセスから親プロセスへそのまま返せる。
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+
+def server_timing_header(stages):
+    """段階ごとの秒数を Server-Timing ヘッダの値 (ミリ秒) にする"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
+
+# ★★★ Prometheus 形式のメトリクス (親プロセスで集計する) ★★★
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """ラベル付きのヒストグラム (バケットは累積で数える)"""
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name, self.help_text = name, help_text
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        counts, total, observations = self._series.get(key, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._series[key] = (counts, total + value, observations + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, observations) in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {observations}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {observations}")
+        return lines
+
+
+class Counter:
+    """ラベル付きのカウンタ"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name, self.help_text = name, help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+def _gauge_lines(name, help_text, samples, metric_type="gauge"):
+    """samples は (ラベルのタプル, 値) のリスト"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    return lines + [f"{name}{_format_labels(labels)} {value}" for labels, value in samples]
+
+
+STAGE_SECONDS = Histogram("spiral_stage_seconds", "処理段階ごとの所要時間 (秒)",
+                          (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0), ("stage",))
+REQUEST_SECONDS = Histogram("spiral_request_seconds", "エンドポイントごとの処理時間 (秒)",
+                            (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0), ("endpoint",))
+OBJECTIVE_EVALUATIONS = Histogram("spiral_objective_evaluations", "1回の螺旋探索での目的関数の評価回数",
+                                  (300, 1000, 3000, 10000, 20000, 30000, 100000), ("optimizer",))
+CENTROID_COUNT = Histogram("spiral_centroids", "画像ごとに抽出された重心の数", (3, 5, 10, 20, 50, 100, 200, 500, 1000, 5000))
+CLUSTER_COUNT = Histogram("spiral_clusters", "螺旋のあてはめに使ったクラスタ数 k", (2, 3, 4, 5, 6, 7, 8, 9, 10))
+OBJECTIVE_EVALUATIONS_TOTAL = Counter("spiral_objective_evaluations_total", "目的関数の評価回数の合計", ("optimizer",))
+SEARCHES_TOTAL = Counter("spiral_searches_total", "螺旋探索の回数 (終了理由別)", ("optimizer", "stop_reason"))
+RESPONSES_TOTAL = Counter("spiral_responses_total", "レスポンス数 (エンドポイント・結果別)", ("endpoint", "outcome"))
+
+
+def observe_stages(stages):
+    for name, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def observe_analysis(result, centroid_count=None):
+    """分析結果の探索統計と、抽出された重心の数を記録する"""
+    search = result.get("search") or {}
+    if "optimizer" in search:
+        OBJECTIVE_EVALUATIONS.observe(search["evaluations"], optimizer=search["optimizer"])
+        OBJECTIVE_EVALUATIONS_TOTAL.inc(search["evaluations"], optimizer=search["optimizer"])
+        SEARCHES_TOTAL.inc(optimizer=search["optimizer"], stop_reason=search["stop_reason"])
+    if "k" in search:
+        CLUSTER_COUNT.observe(search["k"])
+    if centroid_count is not None:
+        CENTROID_COUNT.observe(centroid_count)
+
+
+@contextmanager
+def track_request(endpoint):
+    """エンドポイント全体の処理時間と結果 (ok / cancelled / エラーのステータスコード) を記録する"""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = str(getattr(e, "status_code", 500))
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        RESPONSES_TOTAL.inc(endpoint=endpoint, outcome=outcome)
+
+
+def render_metrics():
+    """/metrics で返す Prometheus のテキスト形式"""
+    lines = []
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, OBJECTIVE_EVALUATIONS, CENTROID_COUNT, CLUSTER_COUNT,
+                   OBJECTIVE_EVALUATIONS_TOTAL, SEARCHES_TOTAL, RESPONSES_TOTAL):
+        lines += metric.render()
+
+    caches = cache_stats()
+    lines += _gauge_lines("spiral_cache_entries", "キャッシュのメモリ層の件数",
+                          [((("cache", name),), stats["entries"]) for name, stats in caches.items()])
+    lines += _gauge_lines("spiral_cache_bytes", "キャッシュのメモリ層の使用量 (バイト)",
+                          [((("cache", name),), stats["bytes"]) for name, stats in caches.items()])
+    lines += _gauge_lines("spiral_cache_lookups_total", "キャッシュの参照回数 (結果別)",
+                          [((("cache", name), ("result", result)), stats[key]) for name, stats in caches.items()
+                           for result, key in (("memory_hit", "hits_memory"), ("disk_hit", "hits_disk"), ("miss", "misses"))],
+                          metric_type="counter")
+
+    pool = pool_status()
+    lines += _gauge_lines("spiral_pool_workers", "分析ワーカーの数", [((), pool["workers"])])
+    lines += _gauge_lines("spiral_pool_queue_size", "実行中に加えて待たせておける件数", [((), pool["queue_size"])])
+    lines += _gauge_lines("spiral_pool_in_flight", "実行中・待機中の分析の件数", [((), pool["in_flight"])])
+    return "\n".join(lines) + "\n"
@@ -1,20 +1,80 @@
 # python_server/main.py
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+import os
+import time
+import queue
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import List, Optional
 import cv2
 import numpy as np
 import io
+import shutil
 import base64
-from sklearn.cluster import KMeans
+import tempfile
+import json
+import logging
 
 # 他のファイルから関数をインポート
-from clustering import extract_object_centroids, find_optimal_k
-from spiral_fit import optimize_spiral_with_golden_ratio,calculate_composition_score
-from visualization import draw_result
-from preprocessing import smart_resize
-app = FastAPI()
+from clustering import extract_centroids_and_areas, find_optimal_k, fit_kmeans, MIN_OBJECT_AREA
+from spiral_fit import calculate_composition_score, spiral_orientation, SCORING_METRICS
+from optimizers import run_optimizer, OPTIMIZERS
+from spatial_index import PointGrid, MAX_GRID_CELLS
+from visualization import draw_result, encode_image, decimated_spiral_polyline, IMAGE_FORMATS
+from preprocessing import smart_resize, decode_image
+from sequence import (iter_frames, thumbnail, frame_change, track_spiral, TrackSummary, CHANGE_THRESHOLD,
+                      SCENE_CUT_THRESHOLD)
+from worker_pool import (run_in_pool, check_capacity, make_progress_channel, start as start_pool, shutdown as shutdown_pool,
+                         ANALYSIS_WORKERS)
+from cache import feature_cache, result_cache, image_digest, cache_stats
+from uploads import (read_upload, save_upload, RequestSizeLimitMiddleware, MAX_UPLOAD_BYTES, MAX_REQUEST_BYTES,
+                     FORM_OVERHEAD_BYTES)
+from instrumentation import (configure_logging, StageTimer, server_timing_header, observe_stages, observe_analysis,
+                             track_request, render_metrics)
+
+# ★★★ print の代わりにログを使う (LOG_LEVEL / LOG_FORMAT で切り替え) ★★★
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# ★★★ 起動時のウォームアップ (WARM_UP=1 で有効) ★★★
+# 小さな合成画像で分析を1回通し、初回リクエストが払っていた遅延読み込み・OpenCV/NumPy の初回実行・
+# BLAS のスレッドプール起動などのコストを、準備完了を報告する前に済ませる
+WARM_UP = os.environ.get("WARM_UP", "0") == "1"
+WARM_UP_SIZE = 160
+WARM_UP_BUDGET = 0.2
+
+def warm_up():
+    started = time.perf_counter()
+    image = np.full((WARM_UP_SIZE, WARM_UP_SIZE, 3), 255, dtype=np.uint8)
+    theta = np.linspace(0, 2.5 * np.pi, 8)
+    r = 4 * np.exp(GOLDEN_B * theta)
+    for x, y in zip(WARM_UP_SIZE / 2 + r * np.cos(theta), WARM_UP_SIZE / 2 + r * np.sin(theta)):
+        cv2.circle(image, (int(x), int(y)), 5, (40, 40, 40), -1)
+    _, encoded = cv2.imencode(".png", image)
+    try:
+        run_analysis_pipeline(encoded.tobytes(), k=0, b_weight=100.0, latency_budget=WARM_UP_BUDGET, seed=0)
+    except Exception:
+        # ウォームアップに失敗しても起動は続ける (初回リクエストが遅くなるだけ)
+        logger.exception("ウォームアップに失敗")
+        return
+    logger.info("ウォームアップ完了", extra={"fields": {"pid": os.getpid(), "seconds": round(time.perf_counter() - started, 3)}})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_pool(warm_up if WARM_UP else None)
+    yield
+    # 終了時にワーカープロセスを片付ける
+    shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
+# ★★★ 本文を読む前に大きすぎるアップロードを 413 で断る (CORS より内側に置き、413 にも CORS ヘッダを付ける) ★★★
+SINGLE_IMAGE_ENDPOINTS = ("/analyze/", "/analyze_stream/", "/preview_clusters/")
+app.add_middleware(RequestSizeLimitMiddleware, default=MAX_REQUEST_BYTES, overhead=FORM_OVERHEAD_BYTES,
+                   limits={path: MAX_UPLOAD_BYTES for path in SINGLE_IMAGE_ENDPOINTS})
 origins = [
     "http://localhost",
     "http://localhost:3000",
@@ -30,76 +90,669 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ブラウザの fetch から結果の JSON と処理時間のヘッダを読めるようにする
+    expose_headers=["X-Analysis-Result", "Server-Timing"],
 )
 
 
 
-# ★★★ run_analysis_pipelineの引数に`b_weight`を追加 ★★★
-def run_analysis_pipeline(image_bytes: bytes, k: int, b_weight: float):
-    # ... (重心抽出、クラスタリング部分は変更なし) ...
-    # ... (中略) ...
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    original_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    resized_image = smart_resize(original_image)
-    initial_centroids, _ = extract_object_centroids(resized_image)
+# ★★★ 画像のデコード・リサイズ・重心抽出 (画像ごとにキャッシュされる特徴量) ★★★
+# ★★★ extraction で重心抽出方式を選ぶ ('components': 連結成分 / 'contours': 従来の輪郭ベース) ★★★
+# ★★★ 表示用の解像度 (描画・レスポンス) と、重心抽出を行う解像度を分けた ★★★
+# ANALYSIS_MAX_DIM: 重心抽出を行う画像の長辺 (0 以下なら表示用と同じ解像度で抽出する)
+EXTRACTION_METHODS = ("components", "contours")
+DISPLAY_MAX_DIM = 2048
+ANALYSIS_MAX_DIM = int(os.environ.get("ANALYSIS_MAX_DIM", 1024))
+
+def load_features(image_bytes: bytes, extraction: str = "components", analysis_max_dim: int = ANALYSIS_MAX_DIM,
+                  timer: Optional[StageTimer] = None) -> dict:
+    if extraction not in EXTRACTION_METHODS: raise HTTPException(status_code=400, detail=f"未知の重心抽出方式です: {extraction}")
+    timer = timer or StageTimer()
+    # ヘッダの寸法を見て、大きな画像は縮小しながらデコードする
+    with timer.stage("decode"):
+        resized_image = decode_image(image_bytes, DISPLAY_MAX_DIM)
+    if resized_image is None: raise HTTPException(status_code=400, detail="画像を読み込めませんでした。")
+    return extract_features(resized_image, extraction, analysis_max_dim, timer)
+
+
+def extract_features(resized_image, extraction: str = "components", analysis_max_dim: int = ANALYSIS_MAX_DIM,
+                     timer: Optional[StageTimer] = None) -> dict:
+    """デコード済みの表示用画像から重心と面積を抽出する (動画のフレームでも使う)"""
+    timer = timer or StageTimer()
+    with timer.stage("resize"):
+        analysis_image = smart_resize(resized_image, analysis_max_dim) if analysis_max_dim > 0 else resized_image
+    # 抽出した重心と面積を表示用の解像度に戻す。最小面積も抽出側の解像度に合わせる
+    scale = resized_image.shape[1] / analysis_image.shape[1]
+    with timer.stage("extract"):
+        initial_centroids, areas = extract_centroids_and_areas(analysis_image, extraction, MIN_OBJECT_AREA / scale ** 2)
+    return {"image": resized_image, "centroids": initial_centroids * scale, "areas": areas * scale ** 2}
+
+
+def _load_task_features(image_bytes: Optional[bytes], features: Optional[dict], options: dict, timer: StageTimer) -> dict:
+    if features is not None: return features
+    return load_features(image_bytes, options.get("extraction", "components"), options.get("analysis_max_dim", ANALYSIS_MAX_DIM), timer)
+
+
+# ★★★ クラスタリング結果は特徴量と一緒に覚えておき、プレビューと分析で使い回す ★★★
+def cluster_features(features: dict, k: int, area_weighted: bool = False, timer: Optional[StageTimer] = None):
+    """k 個のクラスタ中心を返す (k=0 ならエルボー法で決める)。戻り値は (k, 中心の配列)"""
+    clusters = features.setdefault("clusters", {})
+    timer = timer or StageTimer()
+    if (k, area_weighted) not in clusters:
+        points = features["centroids"]
+        sample_weight = features["areas"] if area_weighted else None
+        if k == 0:
+            # エルボー法で選ばれた k のモデルをそのまま使い、同じ k を指定されたときにも再利用する
+            with timer.stage("elbow"):
+                optimal_k, model = find_optimal_k(points, sample_weight=sample_weight, return_model=True)
+            if model is None:
+                with timer.stage("kmeans"):
+                    optimal_k, model = 2, fit_kmeans(points, 2, sample_weight)
+            clusters[(optimal_k, area_weighted)] = (optimal_k, model.cluster_centers_)
+        else:
+            with timer.stage("kmeans"):
+                optimal_k, model = k, fit_kmeans(points, k, sample_weight)
+        clusters[(k, area_weighted)] = (optimal_k, model.cluster_centers_)
+    return clusters[(k, area_weighted)]
+
+
+# 螺旋の採点に使う点 ('clustered': クラスタ中心 (従来どおり), 'raw': 抽出したすべての重心。クラスタリングは行わない)
+SCORE_TARGETS = ("clustered", "raw")
+
+def scoring_points(features: dict, clustered_centroids, score_target: str, area_weighted: bool):
+    """
+    螺旋の採点に使う点と重みを返す。'raw' なら抽出したすべての重心 (area_weighted なら面積で重み付け)、
+    'clustered' ならクラスタ中心 (重みなし)。返すスコア (最終スコアと途中経過) は常にこの点で計算する。
+    """
+    if score_target == "clustered":
+        return clustered_centroids, None
+    return features["centroids"], features["areas"] if area_weighted else None
+
+
+def search_points(points, weights, metric: str, timer: Optional[StageTimer] = None):
+    """
+    探索 (シードと全世代の採点) に使う点を返す。点が MAX_GRID_CELLS[metric] より多いか重みがあれば、
+    一様グリッドの空間インデックス (PointGrid) にまとめる。セル数を上限にするので探索の時間は点の数によらず、
+    代表点と元の点のずれ (max_error) は結果の search.index に載る。
+    """
+    if len(points) <= MAX_GRID_CELLS[metric] and weights is None:
+        return points
+    with (timer or StageTimer()).stage("index"):
+        return PointGrid(points, weights, MAX_GRID_CELLS[metric])
+
+
+# ★★★ /analyze/ 系のエンドポイントと CLI で共通の分析パラメータ ★★★
+@dataclass
+class AnalysisOptions:
+    """run_analysis_pipeline / run_sequence_pipeline に渡す分析パラメータ (動画では latency_budget は1フレームあたり)"""
+    k: int = 0
+    b_weight: float = 100.0
+    metric: str = "sampled"
+    latency_budget: float = 0.0  # 秒。0なら無制限
+    optimizer: str = "ga"
+    seed: Optional[int] = None
+    warm_start: bool = True
+    extraction: str = "components"
+    area_weighted: bool = False
+    score_target: str = "clustered"
+    analysis_max_dim: int = ANALYSIS_MAX_DIM
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def analysis_form(
+    k: int = Form(AnalysisOptions.k),
+    b_weight: float = Form(AnalysisOptions.b_weight),
+    metric: str = Form(AnalysisOptions.metric),
+    latency_budget: float = Form(AnalysisOptions.latency_budget),
+    optimizer: str = Form(AnalysisOptions.optimizer),
+    seed: Optional[int] = Form(AnalysisOptions.seed),
+    warm_start: bool = Form(AnalysisOptions.warm_start),
+    extraction: str = Form(AnalysisOptions.extraction),
+    area_weighted: bool = Form(AnalysisOptions.area_weighted),
+    score_target: str = Form(AnalysisOptions.score_target),
+    analysis_max_dim: int = Form(AnalysisOptions.analysis_max_dim)
+) -> AnalysisOptions:
+    """フォームの分析パラメータを AnalysisOptions にまとめる依存関数 (Depends(analysis_form) で使う)"""
+    return AnalysisOptions(k=k, b_weight=b_weight, metric=metric, latency_budget=latency_budget, optimizer=optimizer,
+                           seed=seed, warm_start=warm_start, extraction=extraction, area_weighted=area_weighted,
+                           score_target=score_target, analysis_max_dim=analysis_max_dim)
+
+
+def validate_analysis_options(metric: str, optimizer: str, extraction: str, score_target: str):
+    """名前で選ぶ分析パラメータを確かめ、未知の値なら 400 にする (静止画と動画のパイプラインで共通)"""
+    if metric not in SCORING_METRICS: raise HTTPException(status_code=400, detail=f"未知のスコアリング方式です: {metric}")
+    if optimizer not in OPTIMIZERS: raise HTTPException(status_code=400, detail=f"未知の最適化バックエンドです: {optimizer}")
+    if extraction not in EXTRACTION_METHODS: raise HTTPException(status_code=400, detail=f"未知の重心抽出方式です: {extraction}")
+    if score_target not in SCORE_TARGETS: raise HTTPException(status_code=400, detail=f"未知の採点対象です: {score_target}")
+
+
+# ワーカープロセスで実行するタスク。親プロセスのキャッシュに戻せるよう特徴量も一緒に返す
+# 3つ目の戻り値は処理段階ごとの秒数 (Server-Timing ヘッダと /metrics に使う)
+# ★★★ memory_lean=True なら、ここでデコードした画像に直接描画し、画像は親プロセスに送り返さない (特徴量はキャッシュされない) ★★★
+def analysis_task(image_bytes: Optional[bytes], features: Optional[dict], **options):
+    timer = StageTimer()
+    draw_in_place = options.get("memory_lean", False) and features is None
+    features = _load_task_features(image_bytes, features, options, timer)
+    result = run_analysis_pipeline(None, features=features, timer=timer, draw_in_place=draw_in_place, **options)
+    if options.get("memory_lean", False):
+        features = {key: value for key, value in features.items() if key != "image"}
+    return result, features, timer.stages
+
+
+# ★★★ ストリーミング用: 途中経過を progress_queue に送り、cancel_event が立ったら探索を打ち切る ★★★
+def stream_task(image_bytes: Optional[bytes], features: Optional[dict], progress_queue, cancel_event, **options):
+    last_sent = {"time": float("-inf"), "score": None}
+
+    def on_progress(event: dict) -> bool:
+        # 送るのはベストが変わったときだけ、かつ STREAM_PROGRESS_INTERVAL 秒に1回まで
+        now = time.monotonic()
+        if event["score"] != last_sent["score"] and now - last_sent["time"] >= STREAM_PROGRESS_INTERVAL:
+            progress_queue.put(event)
+            last_sent.update(time=now, score=event["score"])
+        return cancel_event.is_set()
+
+    timer = StageTimer()
+    features = _load_task_features(image_bytes, features, options, timer)
+    return run_analysis_pipeline(None, features=features, progress_callback=on_progress, timer=timer, **options), features, timer.stages
+
+
+# ★★★ 一括分析用: 1枚分の結果を JSONL の1行にする dict を返す (API と CLI で共通) ★★★
+# overlay_path を渡すと描画結果をそのファイルに保存し、embed_overlay=True なら base64 で埋め込む
+def batch_task(image_bytes: bytes, name: str, overlay_path: Optional[str] = None, embed_overlay: bool = False, **options) -> dict:
+    started = time.perf_counter()
+    record = {"file": name}
+    timer = StageTimer()
+    try:
+        features = load_features(image_bytes, options.get("extraction", "components"), options.get("analysis_max_dim", ANALYSIS_MAX_DIM), timer)
+        record["centroids"] = len(features["centroids"])
+        draw = overlay_path is not None or embed_overlay
+        # 特徴量はこの関数の中でしか使わないので、描画は画像に直接行う
+        result = run_analysis_pipeline(None, features=features, timer=timer, **options, response_format="image" if draw else "vector",
+                                       draw_in_place=True)
+        record.update(score=result["score"], b_value=result["b_value"], spiral=result["spiral"],
+                      orientation=result["orientation"], search=result["search"])
+        if draw:
+            if overlay_path is not None:
+                with open(overlay_path, "wb") as f: f.write(result["image_bytes"])
+                record["overlay"] = overlay_path
+            if embed_overlay:
+                record["image_base64"] = f"data:{result['media_type']};base64," + base64.b64encode(result["image_bytes"]).decode("utf-8")
+    except HTTPException as e:
+        record.update(error=e.detail, status_code=e.status_code)
+    except Exception as e:
+        logger.exception("一括分析で予期せぬエラーが発生", extra={"fields": {"file": name}})
+        record.update(error=str(e), status_code=500)
+    record["timings"] = {stage: round(seconds, 4) for stage, seconds in timer.stages.items()}
+    record["timings"]["total"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+def preview_task(image_bytes: Optional[bytes], features: Optional[dict], **options):
+    timer = StageTimer()
+    features = _load_task_features(image_bytes, features, options, timer)
+    return run_preview_pipeline(None, features=features, timer=timer, **options), features, timer.stages
+
+
+# ★★★ 螺旋パラメータから最終スコア (0〜100) と b を求める (途中経過の送信でも使う) ★★★
+GOLDEN_B = 0.30635
+
+# points, weights は scoring_points の結果 (インデックスではなく元の点で採点する)
+def score_spiral(params: dict, points, image_shape, weights=None):
+    distance_score = calculate_composition_score(params, points, image_shape, weights)
+    score_fit = np.exp(-0.05 * distance_score)
+    b_value = params.get('b', 0)
+    score_golden = np.exp(-50 * abs(b_value - GOLDEN_B))
+    final_score = (0.6 * score_fit + 0.4 * score_golden) * 100
+    return round(float(final_score), 1), round(b_value, 4)
+
+
+RESPONSE_FORMATS = (
+    "base64",     # 従来どおり: 描画済み画像を base64 で JSON に埋め込む
+    "vector",     # 画像なし: スコア・螺旋パラメータ・重心・間引いた螺旋の折れ線だけを返し、描画はクライアントが行う
+    "image",      # 描画済み画像をそのままバイナリで返す (結果の JSON は X-Analysis-Result ヘッダ)
+    "multipart",  # 結果の JSON と描画済み画像を multipart/mixed で返す
+)
+
+# MEMORY_LEAN: /analyze/ の memory_lean の既定値 (1 で有効)
+MEMORY_LEAN = os.environ.get("MEMORY_LEAN", "0") == "1"
+
+def run_analysis_pipeline(image_bytes: Optional[bytes], k: int, b_weight: float, metric: str = "sampled", latency_budget: float = 0.0, optimizer: str = "ga",
+                          seed: Optional[int] = None, warm_start: bool = True, extraction: str = "components", area_weighted: bool = False,
+                          analysis_max_dim: int = ANALYSIS_MAX_DIM, response_format: str = "base64", image_format: str = "png",
+                          image_quality: int = 90, features: Optional[dict] = None, progress_callback=None,
+                          timer: Optional[StageTimer] = None, memory_lean: bool = False, draw_in_place: bool = False,
+                          score_target: str = "clustered"):
+    """
+    1枚の画像を分析し、スコア・螺旋パラメータと (response_format に応じて) 描画結果を dict で返す。
+    - b_weight: 螺旋探索で b を黄金比の値に寄せる重み
+    - metric: 螺旋探索のスコアリング方式 ('sampled' / 'analytic')
+    - latency_budget: 秒。これを超えそうなら螺旋探索を途中で打ち切る (0以下で無制限)
+    - optimizer: 探索バックエンド ('ga' / 'cmaes' / 'ga_nm' / 'pyramid')
+    - seed: 指定すると螺旋探索が決定的になる。warm_start なら重心配置からのシードを使う
+    - extraction, analysis_max_dim: 重心抽出の方式と解像度 (load_features を参照)
+    - area_weighted: 物体の面積で重み付けしてクラスタリング・採点する
+    - score_target: 'raw' ならクラスタリングせず、抽出したすべての重心に対して採点する (SCORE_TARGETS を参照)
+    - features: load_features の結果を渡すと、デコードと重心抽出を省略する
+    - progress_callback(event): 探索の各世代で途中経過の dict を受け取る。True を返すと探索を打ち切る
+    - response_format: レスポンスの形 (RESPONSE_FORMATS を参照。既定は従来どおり base64 埋め込みの JSON)。
+      どの形式でも螺旋のパラメータを "spiral" として、向きを "orientation" ('clockwise' / 'counterclockwise',
+      画像上で外側へ回る向き) として返す
+    - memory_lean: base64 でもエンコード済みのバイト列のまま返し、build_analysis_response が少しずつ base64 にして送る
+    - draw_in_place: features["image"] に直接描画する (呼び出し側がその画像を使い回さない場合だけ)
+    """
+    deadline = time.monotonic() + latency_budget if latency_budget > 0 else None
+    validate_analysis_options(metric, optimizer, extraction, score_target)
+    if response_format not in RESPONSE_FORMATS: raise HTTPException(status_code=400, detail=f"未知のレスポンス形式です: {response_format}")
+    if image_format not in IMAGE_FORMATS: raise HTTPException(status_code=400, detail=f"未知の画像形式です: {image_format}")
+    timer = timer or StageTimer()
+    if features is None: features = load_features(image_bytes, extraction, analysis_max_dim, timer)
+    resized_image, initial_centroids = features["image"], features["centroids"]
     if len(initial_centroids) < 3: raise HTTPException(status_code=400, detail="分析対象オブジェクトが3つ未満です。")
     if k > 0 and k > len(initial_centroids): k = len(initial_centroids)
-    if k == 0: optimal_k = find_optimal_k(initial_centroids)
-    else: optimal_k = k
-    if optimal_k < 2 and len(initial_centroids) >= 2: optimal_k = 2
-    elif len(initial_centroids) < 2: raise HTTPException(status_code=400, detail="分析対象オブジェクトが2つ未満です。")
-    kmeans = KMeans(n_clusters=optimal_k, n_init='auto', random_state=0).fit(initial_centroids)
-    clustered_centroids = kmeans.cluster_centers_
+    # 1 や負の値は元の実装どおり k=2 にする
+    if k < 2 and k != 0: k = 2
+    # k=0 ならエルボー法。選ばれた k の学習済みモデルの中心をそのまま使う
+    optimal_k, clustered_centroids = None, None
+    if score_target == "clustered":
+        optimal_k, clustered_centroids = cluster_features(features, k, area_weighted, timer)
+    points, weights = scoring_points(features, clustered_centroids, score_target, area_weighted)
+    search_index = search_points(points, weights, metric, timer)
 
     # 3. 螺旋フィッティング
     image_shape = resized_image.shape[:2]
+    def report_progress(generation, params, _):
+        final_score, b_value = score_spiral(params, points, image_shape, weights)
+        return progress_callback({ "event": "progress", "generation": generation, "score": final_score, "b_value": b_value,
+                                   "spiral": {name: round(float(value), 4) for name, value in params.items()} })
     # ★★★最適化関数に`b_weight`を渡す ★★★
-    best_params = optimize_spiral_with_golden_ratio(clustered_centroids, image_shape, b_weight)
+    with timer.stage("optimize"):
+        best_params, search_stats = run_optimizer(optimizer, search_index, image_shape, b_weight, metric, deadline=deadline, seed=seed,
+                                                  warm_start=warm_start,
+                                                  progress_callback=report_progress if progress_callback is not None else None)
+    search_stats["score_target"] = score_target
+    if optimal_k is not None: search_stats["k"] = int(optimal_k)
+    if isinstance(search_index, PointGrid): search_stats["index"] = search_index.stats()
 
     # 4. スコアリングと描画
-    # ... (スコアリングと描画、レスポンス作成部分は変更なし) ...
-    distance_score = calculate_composition_score(best_params, clustered_centroids, image_shape)
-    score_fit = np.exp(-0.05 * distance_score)
-    b_value = best_params.get('b', 0)
-    GOLDEN_B = 0.30635
-    score_golden = np.exp(-50 * abs(b_value - GOLDEN_B))
-    final_score = (0.6 * score_fit + 0.4 * score_golden) * 100
-    result_image = draw_result(resized_image, initial_centroids, clustered_centroids, best_params)
-    _, buffer = cv2.imencode(".png", result_image)
-    image_base64 = base64.b64encode(buffer).decode("utf-8")
-    return { "score": round(final_score, 1), "b_value": round(b_value, 4), "golden_b": GOLDEN_B, "image_base64": "data:image/png;base64," + image_base64 }
+    with timer.stage("score"):
+        final_score, b_value = score_spiral(best_params, points, image_shape, weights)
+    result = { "score": final_score, "b_value": b_value, "golden_b": GOLDEN_B, "search": search_stats,
+               "spiral": {name: round(float(value), 4) for name, value in best_params.items()},
+               "orientation": spiral_orientation(best_params) if best_params else None }
+
+    if response_format == "vector":
+        # ★★★ 画像はエンコードせず、クライアントが重ねて描くための情報だけを返す ★★★
+        result.update({
+            "image_size": [int(image_shape[1]), int(image_shape[0])],
+            "initial_centroids": np.round(initial_centroids, 1).tolist(),
+            "clustered_centroids": np.round(clustered_centroids, 1).tolist() if clustered_centroids is not None else [],
+            "spiral_polyline": decimated_spiral_polyline(best_params, image_shape).tolist(),
+        })
+        return result
+
+    with timer.stage("draw"):
+        result_image = draw_result(resized_image, initial_centroids, clustered_centroids, best_params, inplace=draw_in_place)
+    with timer.stage("encode"):
+        # 少しずつ base64 にして送る場合は、エンコード結果を bytes に複製しない
+        stream_base64 = response_format == "base64" and memory_lean
+        encoded, media_type = encode_image(result_image, image_format, image_quality, as_bytes=not stream_base64)
+        del result_image
+        if response_format == "base64" and not stream_base64:
+            result["image_base64"] = f"data:{media_type};base64," + base64.b64encode(encoded).decode("utf-8")
+        else:
+            result["image_bytes"], result["media_type"] = encoded, media_type
+    return result
+
+
+# ★★★ パイプラインの結果を response_format に応じたレスポンスにする ★★★
+# base64 形式でエンコード済みのバイト列を受け取った場合 (memory_lean) は、JSON の文字列全体や base64 の文字列を作らず、
+# BASE64_CHUNK_SIZE (3の倍数) ずつ base64 にしながら送る
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+def _base64_json_chunks(head: bytes, image_bytes):
+    yield head
+    view = memoryview(image_bytes)
+    for start in range(0, len(view), BASE64_CHUNK_SIZE):
+        yield base64.b64encode(view[start:start + BASE64_CHUNK_SIZE])
+    yield b'"}'
+
+
+def build_analysis_response(result: dict, response_format: str = "base64", headers: Optional[dict] = None) -> Response:
+    summary = {key: value for key, value in result.items() if key not in ("image_bytes", "media_type")}
+    if response_format == "base64" and "image_bytes" in result:
+        head = (json.dumps(summary)[:-1] + f', "image_base64": "data:{result["media_type"]};base64,').encode()
+        length = len(head) + 4 * ((len(result["image_bytes"]) + 2) // 3) + 2
+        return StreamingResponse(_base64_json_chunks(head, result["image_bytes"]), media_type="application/json",
+                                 headers={**(headers or {}), "Content-Length": str(length)})
+    if response_format in ("base64", "vector"):
+        return JSONResponse(content=result, headers=headers)
+    if response_format == "image":
+        return Response(content=result["image_bytes"], media_type=result["media_type"],
+                        headers={**(headers or {}), "X-Analysis-Result": json.dumps(summary)})
+    boundary = "spiral-analysis-boundary"
+    body = b"".join((
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(), json.dumps(summary).encode(),
+        f"\r\n--{boundary}\r\nContent-Type: {result['media_type']}\r\nContent-Disposition: inline; filename=result\r\n\r\n".encode(),
+        result["image_bytes"], f"\r\n--{boundary}--\r\n".encode(),
+    ))
+    return Response(content=body, media_type=f"multipart/mixed; boundary={boundary}", headers=headers)
 
 
 # ★★★ APIエンドポイントの引数に`b_weight`を追加 ★★★
 @app.post("/analyze/")
 async def analyze_image(
     file: UploadFile = File(...),
-    k: int = Form(0),
-    b_weight: float = Form(100.0) # デフォルト値を設定
+    analysis: AnalysisOptions = Depends(analysis_form),
+    response_format: str = Form("base64"),
+    image_format: str = Form("png"),
+    image_quality: int = Form(90),
+    memory_lean: bool = Form(MEMORY_LEAN)
 ):
-    image_bytes = await file.read()
+    image_bytes = await read_upload(file)
+    options = dict(analysis.as_dict(), response_format=response_format, image_format=image_format, image_quality=image_quality,
+                   memory_lean=memory_lean)
     try:
-        # パイプラインにkとb_weightの値を渡す
-        analysis_result = run_analysis_pipeline(image_bytes, k, b_weight)
-        return JSONResponse(content=analysis_result)
+        with track_request("analyze"):
+            # ★★★ 同じ画像・同じパラメータの結果はキャッシュから返す ★★★
+            timer = StageTimer()
+            with timer.stage("cache"):
+                image_key = image_digest(image_bytes)
+                result_key = f"{image_key}:{json.dumps(options, sort_keys=True)}"
+                analysis_result = result_cache.get(result_key)
+            if analysis_result is not None:
+                return build_analysis_response(analysis_result, response_format, {"Server-Timing": server_timing_header(timer.stages)})
+
+            # パイプラインにkとb_weightの値を渡す
+            # ★★★ CPUを使う処理はワーカープロセスで実行し、イベントループを止めない ★★★
+            # ★★★ 特徴量がキャッシュにあれば画像のバイト列は送らない ★★★
+            feature_key = f"{image_key}:{analysis.extraction}:{analysis.analysis_max_dim}"
+            features = feature_cache.get(feature_key)
+            with timer.stage("worker"):
+                analysis_result, features, stages = await run_in_pool(analysis_task, None if features else image_bytes, features, **options)
+            # memory_lean では画像が戻ってこないので特徴量はキャッシュしない
+            if "image" in features:
+                feature_cache.put(feature_key, features)
+            # 締め切りで打ち切った結果は、時間があればもっと良くなるのでキャッシュしない
+            if analysis_result["search"]["stop_reason"] not in INCOMPLETE_STOP_REASONS:
+                result_cache.put(result_key, analysis_result)
+            observe_stages(stages)
+            observe_analysis(analysis_result, len(features["centroids"]))
+            return build_analysis_response(analysis_result, response_format,
+                                           {"Server-Timing": server_timing_header({**timer.stages, **stages})})
     except HTTPException as e:
         raise e
-    except Exception as e:
-        print(f"予期せぬエラーが発生: {e}")
+    except Exception:
+        logger.exception("予期せぬエラーが発生")
         raise HTTPException(status_code=500, detail="分析中に内部エラーが発生しました。")
 
 
-# ★★★ バグを修正したプレビュー用APIエンドポイント ★★★
-@app.post("/preview_clusters/")
-async def preview_clusters(
+# ★★★ 探索の途中経過を NDJSON (1行1イベント) で送り続けるエンドポイント ★★★
+# 各行は {"event": "progress", "generation", "score", "b_value", "spiral"} で、最後に {"event": "result", ...} か
+# {"event": "error", "status_code", "detail"} が1行届く。クライアントが接続を切ると探索も打ち切られる。
+# STREAM_PROGRESS_INTERVAL: 途中経過を送る最小間隔 (秒)
+STREAM_PROGRESS_INTERVAL = float(os.environ.get("STREAM_PROGRESS_INTERVAL", 0.1))
+STREAM_POLL_INTERVAL = 0.05
+STREAM_RESPONSE_FORMATS = ("base64", "vector")
+# 探索を最後まで行わなかった結果 (キャッシュしない)
+INCOMPLETE_STOP_REASONS = ("deadline", "cancelled")
+
+def _drain_queue(progress_queue) -> list:
+    events = []
+    try:
+        while True: events.append(progress_queue.get_nowait())
+    except queue.Empty:
+        return events
+
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event) + "\n").encode("utf-8")
+
+
+async def stream_analysis_events(image_bytes: bytes, options: dict, result_key: str, feature_key: str):
+    progress_queue, cancel_event = make_progress_channel()
+    features = feature_cache.get(feature_key)
+    task = asyncio.ensure_future(run_in_pool(stream_task, None if features else image_bytes, features, progress_queue, cancel_event, **options))
+    try:
+        with track_request("analyze_stream"):
+            while not task.done():
+                await asyncio.wait({task}, timeout=STREAM_POLL_INTERVAL)
+                for event in await asyncio.to_thread(_drain_queue, progress_queue):
+                    yield _ndjson(event)
+            analysis_result, features, stages = task.result()
+            feature_cache.put(feature_key, features)
+            if analysis_result["search"]["stop_reason"] not in INCOMPLETE_STOP_REASONS:
+                result_cache.put(result_key, analysis_result)
+            observe_stages(stages)
+            observe_analysis(analysis_result, len(features["centroids"]))
+            # ヘッダは送信済みなので、段階ごとの秒数は最後のイベントに含める
+            yield _ndjson({"event": "result", **analysis_result, "timings": {stage: round(seconds, 4) for stage, seconds in stages.items()}})
+    except HTTPException as e:
+        yield _ndjson({"event": "error", "status_code": e.status_code, "detail": e.detail})
+    except Exception:
+        logger.exception("予期せぬエラーが発生")
+        yield _ndjson({"event": "error", "status_code": 500, "detail": "分析中に内部エラーが発生しました。"})
+    finally:
+        # 接続が切れて途中で止められた場合も、ワーカー側の探索を止めて空きを作る
+        if not task.done():
+            cancel_event.set()
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+@app.post("/analyze_stream/")
+async def analyze_image_stream(
     file: UploadFile = File(...),
-    k: int = Form(0)
+    analysis: AnalysisOptions = Depends(analysis_form),
+    response_format: str = Form("vector"),
+    image_format: str = Form("png"),
+    image_quality: int = Form(90)
+):
+    if response_format not in STREAM_RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"ストリーミングで使えないレスポンス形式です: {response_format}")
+    image_bytes = await read_upload(file)
+    options = dict(analysis.as_dict(), response_format=response_format, image_format=image_format, image_quality=image_quality)
+    image_key = image_digest(image_bytes)
+    result_key = f"{image_key}:{json.dumps(options, sort_keys=True)}"
+    analysis_result = result_cache.get(result_key)
+    if analysis_result is not None:
+        return StreamingResponse(iter([_ndjson({"event": "result", **analysis_result})]), media_type="application/x-ndjson")
+    # 混雑時はストリームを始める前に 429 を返す
+    check_capacity()
+    feature_key = f"{image_key}:{analysis.extraction}:{analysis.analysis_max_dim}"
+    return StreamingResponse(stream_analysis_events(image_bytes, options, result_key, feature_key), media_type="application/x-ndjson")
+
+
+# ★★★ 複数画像の一括分析。終わった順に1枚1行の NDJSON で返す ★★★
+# 各行は batch_task の結果 (file, index, score, b_value, spiral, search, timings。失敗した画像は error と status_code)
+# overlays=True なら描画結果を base64 で各行に埋め込む。同時に処理するのはワーカー数まで
+@app.post("/analyze_batch/")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    analysis: AnalysisOptions = Depends(analysis_form),
+    image_format: str = Form("png"),
+    image_quality: int = Form(90),
+    overlays: bool = Form(False)
 ):
-    image_bytes = await file.read()
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    original_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    resized_image = smart_resize(original_image)
-    initial_centroids, _ = extract_object_centroids(resized_image)
+    options = dict(analysis.as_dict(), image_format=image_format, image_quality=image_quality)
+    check_capacity()
+    slots = asyncio.Semaphore(max(1, ANALYSIS_WORKERS))
+
+    async def analyze_one(index: int, upload: UploadFile) -> dict:
+        async with slots:
+            try:
+                image_bytes = await read_upload(upload)
+                # shield: 接続が切れて取り消されても、ワーカーに渡した分は終わるまで実行中として数える
+                record = await asyncio.shield(run_in_pool(batch_task, image_bytes, upload.filename, embed_overlay=overlays, **options))
+            except HTTPException as e:
+                # 大きすぎる (413) 画像や、混雑 (429) などでワーカーに渡せなかった画像も、その画像の行としてエラーを返す
+                record = {"file": upload.filename, "error": e.detail, "status_code": e.status_code}
+        observe_stages({stage: seconds for stage, seconds in record.get("timings", {}).items() if stage != "total"})
+        if "error" not in record:
+            observe_analysis(record, record["centroids"])
+        return {"index": index, **record}
+
+    async def records():
+        tasks = [asyncio.ensure_future(analyze_one(i, upload)) for i, upload in enumerate(files)]
+        try:
+            with track_request("analyze_batch"):
+                for finished in asyncio.as_completed(tasks):
+                    yield _ndjson(await finished)
+        finally:
+            # 接続が切れたら、まだワーカーに渡していない画像は処理しない
+            for task in tasks: task.cancel()
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+# ★★★ 動画・連写のフレーム列を分析し、1フレームごとの結果を返すジェネレータ ★★★
+# フレームは1枚ずつデコードし、保持するのは最後に重心を抽出したフレームの特徴量と前のフレームの螺旋だけ。
+# 最後に抽出したフレームとの差が change_threshold 以下なら、重心が同じなので前のフレームの螺旋とスコアをそのまま使う。
+# 抽出し直したフレームは前のフレームのベストの周りだけを短く探し (track_spiral)、
+# 差が scene_cut_threshold を超えた (場面が変わった) ときは通常の探索からやり直す。
+def run_sequence_pipeline(paths: List[str], k: int, b_weight: float, metric: str = "sampled", latency_budget: float = 0.0,
+                          optimizer: str = "ga", seed: Optional[int] = None, warm_start: bool = True,
+                          extraction: str = "components", area_weighted: bool = False,
+                          analysis_max_dim: int = ANALYSIS_MAX_DIM, change_threshold: float = CHANGE_THRESHOLD,
+                          scene_cut_threshold: float = SCENE_CUT_THRESHOLD, frame_step: int = 1, score_target: str = "clustered"):
+    validate_analysis_options(metric, optimizer, extraction, score_target)
+    if frame_step < 1: raise HTTPException(status_code=400, detail="frame_step は1以上にしてください。")
+    reference, features, previous = None, None, None
+    try:
+        for index, seconds, image in iter_frames(paths, DISPLAY_MAX_DIM, frame_step):
+            started = time.perf_counter()
+            deadline = time.monotonic() + latency_budget if latency_budget > 0 else None
+            record = {"frame": index, "time": None if seconds is None else round(seconds, 3)}
+            current = thumbnail(image)
+            change = 1.0 if reference is None or image.shape[:2] != features["shape"] else frame_change(reference, current)
+            record["change"] = round(change, 4)
+            record["reextracted"] = change > change_threshold
+            if record["reextracted"]:
+                # 描画はしないので、抽出した重心だけを残してフレームの画像は手放す
+                features = extract_features(image, extraction, analysis_max_dim)
+                features["shape"] = features.pop("image").shape[:2]
+                reference = current
+            image_shape = features["shape"]
+            if not record["reextracted"] and previous is not None:
+                record.update({key: previous["record"][key] for key in ("score", "b_value", "spiral", "orientation")},
+                              search={"optimizer": "reused", "generations": 0, "evaluations": 0, "stop_reason": "reused",
+                                      **{key: previous["record"]["search"][key] for key in ("score_target", "k")
+                                         if key in previous["record"]["search"]}},
+                              seconds=round(time.perf_counter() - started, 4))
+                yield record
+                continue
+            if len(features["centroids"]) < 3:
+                # 次のフレームがこのフレームの結果 (無し) を使い回さないよう、引き継ぐ螺旋も捨てる
+                previous = None
+                record.update(error="分析対象オブジェクトが3つ未満です。", seconds=round(time.perf_counter() - started, 4))
+                yield record
+                continue
+
+            optimal_k, clustered_centroids = None, None
+            if score_target == "clustered":
+                frame_k = min(k, len(features["centroids"]))
+                if frame_k < 2 and frame_k != 0: frame_k = 2
+                optimal_k, clustered_centroids = cluster_features(features, frame_k, area_weighted)
+            points, weights = scoring_points(features, clustered_centroids, score_target, area_weighted)
+            search_index = search_points(points, weights, metric)
+            rng = np.random.default_rng(None if seed is None else seed + index)
+            if previous is None or change > scene_cut_threshold or previous["shape"] != image_shape:
+                best_params, search_stats = run_optimizer(optimizer, search_index, image_shape, b_weight, metric,
+                                                          deadline=deadline, seed=None if seed is None else seed + index,
+                                                          warm_start=warm_start)
+            else:
+                best_params, search_stats = track_spiral(search_index, image_shape, b_weight, previous["params"],
+                                                         metric, deadline=deadline, rng=rng)
+            search_stats["score_target"] = score_target
+            if optimal_k is not None: search_stats["k"] = int(optimal_k)
+            if isinstance(search_index, PointGrid): search_stats["index"] = search_index.stats()
+            final_score, b_value = score_spiral(best_params, points, image_shape, weights)
+            record.update(score=final_score, b_value=b_value, search=search_stats,
+                          spiral={name: round(float(value), 4) for name, value in best_params.items()},
+                          orientation=spiral_orientation(best_params), seconds=round(time.perf_counter() - started, 4))
+            previous = {"params": best_params, "shape": image_shape, "record": record}
+            yield record
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ワーカープロセスで実行するタスク。フレームごとの結果を progress_queue に送り、集計を返す
+def sequence_task(paths: List[str], progress_queue, cancel_event, **options) -> dict:
+    summary = TrackSummary()
+    for record in run_sequence_pipeline(paths, **options):
+        summary.add(record)
+        progress_queue.put({"event": "frame", **record})
+        if cancel_event.is_set(): break
+    return summary.as_dict()
+
+
+# ★★★ 動画 (1ファイル) か連写 (複数の画像) を分析し、1フレーム1行の NDJSON で返す ★★★
+# 各行は {"event": "frame", "frame", "time", "change", "reextracted", "score", "b_value", "spiral", "orientation", "search", "seconds"}
+# (重心が足りないフレームは score の代わりに error)。最後に {"event": "summary", ...} か {"event": "error", ...} が1行届く。
+# アップロードは一時ディレクトリに少しずつ書き出し、フレームもワーカーで1枚ずつデコードするので、クリップの長さによらずメモリは一定。
+
+async def stream_sequence_events(paths: List[str], workdir: str, options: dict):
+    progress_queue, cancel_event = make_progress_channel()
+    started = time.perf_counter()
+    task = asyncio.ensure_future(run_in_pool(sequence_task, paths, progress_queue, cancel_event, **options))
+    try:
+        with track_request("analyze_sequence"):
+            while not task.done():
+                await asyncio.wait({task}, timeout=STREAM_POLL_INTERVAL)
+                for event in await asyncio.to_thread(_drain_queue, progress_queue):
+                    yield _ndjson(event)
+            summary = task.result()
+            for event in _drain_queue(progress_queue):
+                yield _ndjson(event)
+            yield _ndjson({"event": "summary", **summary, "seconds": round(time.perf_counter() - started, 4)})
+    except HTTPException as e:
+        yield _ndjson({"event": "error", "status_code": e.status_code, "detail": e.detail})
+    except Exception:
+        logger.exception("予期せぬエラーが発生")
+        yield _ndjson({"event": "error", "status_code": 500, "detail": "分析中に内部エラーが発生しました。"})
+    finally:
+        if not task.done():
+            cancel_event.set()
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            # 一時ファイルはワーカーが読み終えてから消す
+            task.add_done_callback(lambda t: shutil.rmtree(workdir, ignore_errors=True))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+@app.post("/analyze_sequence/")
+async def analyze_sequence(
+    files: List[UploadFile] = File(...),
+    analysis: AnalysisOptions = Depends(analysis_form), # latency_budget は1フレームあたり
+    change_threshold: float = Form(CHANGE_THRESHOLD),
+    scene_cut_threshold: float = Form(SCENE_CUT_THRESHOLD),
+    frame_step: int = Form(1)
+):
+    options = dict(analysis.as_dict(), change_threshold=change_threshold, scene_cut_threshold=scene_cut_threshold,
+                   frame_step=frame_step)
+    check_capacity()
+    workdir = tempfile.mkdtemp(prefix="spiral-sequence-")
+    paths = []
+    try:
+        for i, upload in enumerate(files):
+            # 動画かどうかは拡張子で判定するので、元のファイル名の拡張子を残す
+            path = os.path.join(workdir, f"{i:06d}{os.path.splitext(upload.filename or '')[1].lower()}")
+            await save_upload(upload, path)
+            paths.append(path)
+    except Exception:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+    return StreamingResponse(stream_sequence_events(paths, workdir, options), media_type="application/x-ndjson")
+
+
+# ★★★ プレビュー画像の生成 (ワーカープロセスで実行するため関数に切り出し) ★★★
+def run_preview_pipeline(image_bytes: Optional[bytes], k: int, extraction: str = "components", area_weighted: bool = False,
+                         analysis_max_dim: int = ANALYSIS_MAX_DIM, features: Optional[dict] = None,
+                         timer: Optional[StageTimer] = None) -> bytes:
+    timer = timer or StageTimer()
+    if features is None: features = load_features(image_bytes, extraction, analysis_max_dim, timer)
+    resized_image, initial_centroids = features["image"], features["centroids"]
+    sample_weight = features["areas"] if area_weighted else None
     
     clustered_centroids = None # 結果を格納する変数を初期化
 
@@ -108,19 +761,52 @@ async def preview_clusters(
         clustered_centroids = initial_centroids
     elif k == 1:
         # k=1の場合は、全重心の平均点を計算（これが唯一のクラスタ中心）
-        print("k=1, calculating the mean of all centroids.")
-        clustered_centroids = np.array([np.mean(initial_centroids, axis=0)])
+        logger.debug("k=1 のため全重心の平均をクラスタ中心にする")
+        clustered_centroids = np.array([np.average(initial_centroids, axis=0, weights=sample_weight)])
     elif k >= 2:
         # kが重心の数より多い場合は、重心の数に丸める
         num_points = len(initial_centroids)
         k_to_use = min(k, num_points)
-        print(f"k={k}, running KMeans with {k_to_use} clusters.")
-        kmeans = KMeans(n_clusters=k_to_use, n_init='auto', random_state=0).fit(initial_centroids)
-        clustered_centroids = kmeans.cluster_centers_
+        logger.debug("プレビュー用に KMeans を実行", extra={"fields": {"k": k, "k_used": k_to_use}})
+        _, clustered_centroids = cluster_features(features, k_to_use, area_weighted, timer)
     # k=0 (Auto) の場合は、clustered_centroidsがNoneのままになり、青い点は描画されない
     
     # 螺旋なしで、重心の位置だけを描画
-    preview_image = draw_result(resized_image, initial_centroids, clustered_centroids, None)
+    with timer.stage("draw"):
+        preview_image = draw_result(resized_image, initial_centroids, clustered_centroids, None)
+
+    with timer.stage("encode"):
+        _, buffer = cv2.imencode(".png", preview_image)
+    return buffer.tobytes()
+
+
+# ★★★ バグを修正したプレビュー用APIエンドポイント ★★★
+@app.post("/preview_clusters/")
+async def preview_clusters(
+    file: UploadFile = File(...),
+    k: int = Form(0),
+    extraction: str = Form("components"),
+    area_weighted: bool = Form(False),
+    analysis_max_dim: int = Form(ANALYSIS_MAX_DIM)
+):
+    image_bytes = await read_upload(file)
+    with track_request("preview_clusters"):
+        feature_key = f"{image_digest(image_bytes)}:{extraction}:{analysis_max_dim}"
+        features = feature_cache.get(feature_key)
+        png_bytes, features, stages = await run_in_pool(preview_task, None if features else image_bytes, features,
+                                                        k=k, extraction=extraction, area_weighted=area_weighted, analysis_max_dim=analysis_max_dim)
+        feature_cache.put(feature_key, features)
+        observe_stages(stages)
+    return StreamingResponse(io.BytesIO(png_bytes), media_type="image/png", headers={"Server-Timing": server_timing_header(stages)})
+
+
+# ★★★ キャッシュのヒット・ミス回数と使用量 ★★★
+@app.get("/cache_stats/")
+async def get_cache_stats():
+    return cache_stats()
+
 
-    _, buffer = cv2.imencode(".png", preview_image)
-    return StreamingResponse(io.BytesIO(buffer.tobytes()), media_type="image/png")
+# ★★★ Prometheus 形式のメトリクス (段階ごとの所要時間・評価回数・重心数・キャッシュ・待ち行列) ★★★
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
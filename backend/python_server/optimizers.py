@@ -0,0 +1,292 @@
+# python_server/optimizers.py
+
+import time
+import logging
+import numpy as np
+
+from spiral_fit import (
+    PARAM_NAMES, NUM_CANDIDATES, MIN_A_THRESHOLD, evaluate_population, array_to_params, get_search_ranges,
+    mutation_sigmas, optimize_spiral_with_golden_ratio, genetic_search,
+)
+from seeding import seed_spirals, SEED_FRACTION
+
+logger = logging.getLogger(__name__)
+
+# --- 各バックエンドの設定項目 ---
+# CMA-ES: 一様サンプルの上位から順に、評価回数の上限に達するまで短い局所探索を繰り返す
+CMAES_MAX_EVALUATIONS = 3000
+CMAES_INITIAL_SAMPLES = 300
+CMAES_POPULATION = 8
+CMAES_SIGMA0 = 0.1
+CMAES_TOL_SIGMA = 1e-3
+# GA + Nelder-Mead: 短い GA の後に単体法で仕上げる
+HYBRID_GA_GENERATIONS = 12
+HYBRID_GA_CANDIDATES = 150
+HYBRID_NM_EVALUATIONS = 400
+NM_INITIAL_STEP = 0.05
+NM_TOL = 1e-6
+# 粗密探索: 粗いθで短い GA を回し、上位の候補の周りに範囲と変異の幅を絞って細かいθで仕上げる
+PYRAMID_COARSE_THETA = 50
+PYRAMID_COARSE_GENERATIONS = 25
+PYRAMID_COARSE_CANDIDATES = 150
+PYRAMID_COARSE_PATIENCE = 10
+PYRAMID_TOP_K = 5
+PYRAMID_FINE_GENERATIONS = 20
+PYRAMID_FINE_CANDIDATES = 100
+PYRAMID_FINE_PATIENCE = 8
+# 細かい段階の変異の幅 (通常の GA に対する倍率)。探索範囲は上位候補の外接範囲をこの幅の PYRAMID_BOX_SIGMAS 倍だけ広げる
+PYRAMID_SIGMA_SCALE = 0.25
+PYRAMID_BOX_SIGMAS = 2.0
+
+# 全バックエンドの共通インターフェース:
+#   optimizer(points, image_shape, b_penalty_weight, metric='sampled', deadline=None,
+#             initial_population=None, rng=None, progress_callback=None) -> (best_params, stats)
+# stats には 'generations' (反復回数), 'evaluations' (目的関数の評価回数), 'stop_reason' が入る
+# progress_callback(generation, best_params, best_score) は反復ごとに呼ばれ、True を返すと
+# 探索を中断してその時点のベストを返す (stop_reason='cancelled')
+
+
+def _make_objective(points, image_shape, b_penalty_weight, metric, search_ranges, stats):
+    """
+    [0, 1]^6 に正規化した座標で候補 (N×6) を受け取り、最終スコアを返す目的関数を作る。
+    評価した行数は stats['evaluations'] に加算する。
+    """
+    lows = np.array([search_ranges[name][0] for name in PARAM_NAMES])
+    spans = np.array([search_ranges[name][1] for name in PARAM_NAMES]) - lows
+
+    def to_params(x):
+        return lows + np.atleast_2d(x) * spans
+
+    def objective(x):
+        population = to_params(x)
+        stats['evaluations'] += len(population)
+        return evaluate_population(population, points, image_shape, b_penalty_weight, metric)
+
+    return objective, to_params, lows, spans
+
+
+def _nelder_mead(objective, x0, max_evaluations, deadline=None, step=NM_INITIAL_STEP, tol=NM_TOL, iteration_callback=None):
+    """
+    NumPy だけで書いた Nelder-Mead 法 (正規化座標上)。(best_x, best_score, cancelled) を返す。
+    iteration_callback(iteration, best_x, best_score) が True を返したら中断する。
+    """
+    n = len(x0)
+    simplex = np.vstack((x0, x0 + step * np.eye(n)))
+    values = objective(simplex)
+    evaluations, iteration, cancelled = n + 1, 0, False
+    while evaluations < max_evaluations:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        order = np.argsort(values, kind='stable')
+        simplex, values = simplex[order], values[order]
+        iteration += 1
+        if iteration_callback is not None and iteration_callback(iteration, simplex[0], values[0]):
+            cancelled = True
+            break
+        if np.isfinite(values[-1]) and values[-1] - values[0] < tol:
+            break
+        centroid = simplex[:-1].mean(axis=0)
+        reflected = centroid + (centroid - simplex[-1])
+        f_reflected = objective(reflected)[0]
+        evaluations += 1
+        if f_reflected < values[0]:
+            expanded = centroid + 2.0 * (centroid - simplex[-1])
+            f_expanded = objective(expanded)[0]
+            evaluations += 1
+            if f_expanded < f_reflected:
+                simplex[-1], values[-1] = expanded, f_expanded
+            else:
+                simplex[-1], values[-1] = reflected, f_reflected
+        elif f_reflected < values[-2]:
+            simplex[-1], values[-1] = reflected, f_reflected
+        else:
+            # 収縮し、それでも改善しなければベスト点に向かって縮小する
+            toward = reflected if f_reflected < values[-1] else simplex[-1]
+            contracted = centroid + 0.5 * (toward - centroid)
+            f_contracted = objective(contracted)[0]
+            evaluations += 1
+            if f_contracted < min(f_reflected, values[-1]):
+                simplex[-1], values[-1] = contracted, f_contracted
+            else:
+                simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+                values[1:] = objective(simplex[1:])
+                evaluations += n
+    best = np.argmin(values)
+    return simplex[best], values[best], cancelled
+
+
+def optimize_spiral_cmaes(points, image_shape, b_penalty_weight, metric='sampled', deadline=None,
+                          initial_population=None, rng=None, max_evaluations=CMAES_MAX_EVALUATIONS,
+                          progress_callback=None):
+    """
+    NumPy だけで実装した CMA-ES で螺旋パラメータを探索する。
+    一様サンプル (と initial_population) の上位から開始し、ステップ幅が収束したら次に良い点から再スタートする。
+    目的関数は多峰的 (隣の巻きに乗り移る解が多い) なので、長い1回の探索より短い探索を何度も行う。
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    stats = {'generations': 0, 'evaluations': 0, 'stop_reason': 'completed'}
+    search_ranges = get_search_ranges(image_shape)
+    objective, to_params, lows, spans = _make_objective(points, image_shape, b_penalty_weight, metric, search_ranges, stats)
+    n = len(PARAM_NAMES)
+
+    starts = rng.uniform(0, 1, size=(CMAES_INITIAL_SAMPLES, n))
+    if initial_population is not None and len(initial_population) > 0:
+        starts = np.vstack(((np.asarray(initial_population, dtype=float) - lows) / spans, starts[len(initial_population):]))
+    start_scores = objective(starts)
+    start_order = np.argsort(start_scores, kind='stable')
+    best_x, best_score = starts[start_order[0]], start_scores[start_order[0]]
+
+    # 戦略パラメータ (Hansen のチュートリアルの既定値)
+    lam = CMAES_POPULATION
+    mu = lam // 2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= weights.sum()
+    mueff = 1.0 / np.sum(weights ** 2)
+    cc = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+    cs = (mueff + 2) / (n + mueff + 5)
+    c1 = 2 / ((n + 1.3) ** 2 + mueff)
+    cmu = min(1 - c1, 2 * (mueff - 2 + 1 / mueff) / ((n + 2) ** 2 + mueff))
+    damps = 1 + 2 * max(0.0, np.sqrt((mueff - 1) / (n + 1)) - 1) + cs
+    chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+    for start_index in start_order:
+        if stats['evaluations'] + lam > max_evaluations or stats['stop_reason'] != 'completed':
+            break
+        iteration = 0
+        mean = starts[start_index].copy()
+        sigma = CMAES_SIGMA0
+        cov, p_sigma, p_c = np.eye(n), np.zeros(n), np.zeros(n)
+        while stats['evaluations'] + lam <= max_evaluations:
+            eigvals, basis = np.linalg.eigh(cov)
+            scale = np.sqrt(np.maximum(eigvals, 1e-20))
+            z = rng.standard_normal((lam, n))
+            y = (z * scale) @ basis.T
+            x = mean + sigma * y
+            scores = objective(x)
+            stats['generations'] += 1
+            iteration += 1
+
+            order = np.argsort(scores, kind='stable')
+            if scores[order[0]] < best_score:
+                best_x, best_score = x[order[0]].copy(), scores[order[0]]
+            y_w = weights @ y[order[:mu]]
+            mean = mean + sigma * y_w
+
+            inv_sqrt_cov = basis @ np.diag(1 / scale) @ basis.T
+            p_sigma = (1 - cs) * p_sigma + np.sqrt(cs * (2 - cs) * mueff) * (inv_sqrt_cov @ y_w)
+            h_sigma = np.linalg.norm(p_sigma) / np.sqrt(1 - (1 - cs) ** (2 * iteration)) < (1.4 + 2 / (n + 1)) * chi_n
+            p_c = (1 - cc) * p_c + h_sigma * np.sqrt(cc * (2 - cc) * mueff) * y_w
+            rank_mu = (weights[:, None] * y[order[:mu]]).T @ y[order[:mu]]
+            cov = ((1 - c1 - cmu) * cov + c1 * (np.outer(p_c, p_c) + (1 - h_sigma) * cc * (2 - cc) * cov)
+                   + cmu * rank_mu)
+            sigma *= np.exp((cs / damps) * (np.linalg.norm(p_sigma) / chi_n - 1))
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("CMA-ES の世代", extra={"fields": {"generation": stats['generations'], "evaluations": stats['evaluations'],
+                                                             "sigma": round(float(sigma), 5), "best_score": round(float(best_score), 4)}})
+            if (progress_callback is not None and np.isfinite(best_score)
+                    and progress_callback(stats['generations'], array_to_params(to_params(best_x)[0]), float(best_score))):
+                stats['stop_reason'] = 'cancelled'
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                stats['stop_reason'] = 'deadline'
+                break
+            if not np.isfinite(sigma) or sigma * scale.max() < CMAES_TOL_SIGMA:
+                break
+
+    best_params = array_to_params(to_params(best_x)[0]) if np.isfinite(best_score) else {}
+    return best_params, stats
+
+
+def optimize_spiral_ga_nelder_mead(points, image_shape, b_penalty_weight, metric='sampled', deadline=None,
+                                   initial_population=None, rng=None, nm_evaluations=HYBRID_NM_EVALUATIONS,
+                                   progress_callback=None):
+    """短い GA で大域的に探し、得られたベストを Nelder-Mead 法で局所的に仕上げる"""
+    ga_params, ga_stats = optimize_spiral_with_golden_ratio(
+        points, image_shape, b_penalty_weight, metric, deadline=deadline,
+        generations=HYBRID_GA_GENERATIONS, n_candidates=HYBRID_GA_CANDIDATES,
+        initial_population=initial_population, rng=rng, progress_callback=progress_callback)
+    stats = {'generations': ga_stats['generations'], 'evaluations': ga_stats['evaluations'], 'stop_reason': ga_stats['stop_reason']}
+    if not ga_params or stats['stop_reason'] in ('deadline', 'cancelled'):
+        return ga_params, stats
+
+    search_ranges = get_search_ranges(image_shape)
+    objective, to_params, lows, spans = _make_objective(points, image_shape, b_penalty_weight, metric, search_ranges, stats)
+    x0 = (np.array([ga_params[name] for name in PARAM_NAMES]) - lows) / spans
+    # 単体法の反復は GA の世代の続きとして数える
+    def report_iteration(iteration, x, score):
+        return np.isfinite(score) and progress_callback(stats['generations'] + iteration, array_to_params(to_params(x)[0]), float(score))
+    best_x, best_score, cancelled = _nelder_mead(objective, x0, nm_evaluations, deadline,
+                                                 iteration_callback=report_iteration if progress_callback is not None else None)
+    if cancelled:
+        stats['stop_reason'] = 'cancelled'
+    best_params = array_to_params(to_params(best_x)[0])
+    if not best_params['a'] >= MIN_A_THRESHOLD or not np.isfinite(best_score):
+        return ga_params, stats
+    return best_params, stats
+
+
+def optimize_spiral_pyramid(points, image_shape, b_penalty_weight, metric='sampled', deadline=None,
+                            initial_population=None, rng=None, progress_callback=None):
+    """
+    粗密 (ピラミッド) 探索。まずθを PYRAMID_COARSE_THETA 個に減らした安い評価で短い GA を回し、
+    その上位 PYRAMID_TOP_K 個の外接範囲に探索範囲を、変異の幅を PYRAMID_SIGMA_SCALE 倍に絞って、
+    通常のθで短い GA を回して仕上げる。上位の候補は細かい段階の初期集団にも入れる。
+    stats['evaluations'] は両段階の合計、stats['coarse_evaluations'] はそのうち粗い段階の分。
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    coarse_params, coarse_stats, elites = genetic_search(
+        points, image_shape, b_penalty_weight, metric, patience=PYRAMID_COARSE_PATIENCE, deadline=deadline,
+        generations=PYRAMID_COARSE_GENERATIONS, n_candidates=PYRAMID_COARSE_CANDIDATES,
+        initial_population=initial_population, rng=rng, progress_callback=progress_callback,
+        theta_samples=PYRAMID_COARSE_THETA)
+    stats = {'generations': coarse_stats['generations'], 'evaluations': coarse_stats['evaluations'],
+             'coarse_evaluations': coarse_stats['evaluations'], 'stop_reason': coarse_stats['stop_reason']}
+    if len(elites) == 0 or stats['stop_reason'] in ('deadline', 'cancelled'):
+        return coarse_params, stats
+
+    top = elites[:PYRAMID_TOP_K]
+    sigmas = mutation_sigmas(image_shape) * PYRAMID_SIGMA_SCALE
+    lows, highs = top.min(axis=0) - PYRAMID_BOX_SIGMAS * sigmas, top.max(axis=0) + PYRAMID_BOX_SIGMAS * sigmas
+    search_ranges = {name: [lows[i], highs[i]] for i, name in enumerate(PARAM_NAMES)}
+    # 細かい段階の世代は粗い段階の続きとして数える
+    def report_fine(generation, params, score):
+        return progress_callback(stats['generations'] + generation, params, score)
+    fine_params, fine_stats = optimize_spiral_with_golden_ratio(
+        points, image_shape, b_penalty_weight, metric, patience=PYRAMID_FINE_PATIENCE, deadline=deadline,
+        generations=PYRAMID_FINE_GENERATIONS, n_candidates=PYRAMID_FINE_CANDIDATES, initial_population=top,
+        rng=rng, progress_callback=report_fine if progress_callback is not None else None,
+        search_ranges=search_ranges, sigmas=sigmas)
+    stats['generations'] += fine_stats['generations']
+    stats['evaluations'] += fine_stats['evaluations']
+    stats['stop_reason'] = fine_stats['stop_reason']
+    return fine_params or coarse_params, stats
+
+
+# 名前で選べる最適化バックエンド ('ga' が従来の既定)
+OPTIMIZERS = {
+    'ga': optimize_spiral_with_golden_ratio,
+    'cmaes': optimize_spiral_cmaes,
+    'ga_nm': optimize_spiral_ga_nelder_mead,
+    'pyramid': optimize_spiral_pyramid,
+}
+
+def run_optimizer(name, points, image_shape, b_penalty_weight, metric='sampled', deadline=None,
+                  seed=None, warm_start=True, progress_callback=None):
+    """
+    名前で指定したバックエンドで螺旋を探索し、(best_params, stats) を返す。
+    warm_start=True なら重心の配置から解析的に作ったシードで初期集団の一部 (SEED_FRACTION) を埋める。
+    seed を指定すると乱数生成器を固定し、シード生成も探索も決定的になる。
+    """
+    if name not in OPTIMIZERS:
+        raise ValueError(f"未知の最適化バックエンドです: {name}")
+    rng = np.random.default_rng(seed)
+    seeds, seed_evaluations = None, 0
+    if warm_start:
+        seeds, seed_evaluations = seed_spirals(points, image_shape, int(NUM_CANDIDATES * SEED_FRACTION), b_penalty_weight, metric, rng)
+    best_params, stats = OPTIMIZERS[name](points, image_shape, b_penalty_weight, metric, deadline=deadline,
+                                          initial_population=seeds, rng=rng, progress_callback=progress_callback)
+    stats['evaluations'] += seed_evaluations
+    stats['optimizer'] = name
+    stats['seed'] = seed
+    return best_params, stats
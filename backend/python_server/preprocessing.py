@@ -1,4 +1,7 @@
+import io
 import cv2
+import numpy as np
+from PIL import Image
 
 # ★★★ スマートリサイズ関数を新しく追加 ★★★
 def smart_resize(image, max_dim=2048):
@@ -19,4 +22,38 @@ def smart_resize(image, max_dim=2048):
         new_w = int(w * (max_dim / h))
     
     # cv2.INTER_AREAは、画像を縮小する際に最も品質が良いとされる補間方法
-    return cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
\ No newline at end of file
+    return cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+# ★★★ デコード時の縮小 ★★★
+# JPEG などは 1/2, 1/4, 1/8 に縮小しながらデコードできるので、必要な解像度より十分大きい画像は
+# フル解像度で展開せずに済ませる (OpenCV が対応していない形式は通常のデコードにフォールバックする)
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def read_image_size(image_bytes):
+    """
+    画像のヘッダだけを読んで (幅, 高さ) を返す。読めなければ None
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.size
+    except Exception:
+        return None
+
+def decode_image(image_bytes, max_dim=2048):
+    """
+    画像をデコードし、長辺が max_dim 以下になるようにする。
+    ヘッダの寸法から、縮小後も max_dim 以上残る最大の縮小率を選んでデコードし、最後に smart_resize で整える。
+    """
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    size = read_image_size(image_bytes)
+    image = None
+    if size is not None:
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if max(size) // factor >= max_dim:
+                image = cv2.imdecode(nparr, flag)
+                break
+    if image is None:
+        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return smart_resize(image, max_dim)
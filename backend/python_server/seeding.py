@@ -0,0 +1,88 @@
+# python_server/seeding.py
+
+import numpy as np
+
+from spatial_index import weighted_points
+from spiral_fit import PARAM_NAMES, CX, CY, A, B, ROT, CHIR, MIN_A_THRESHOLD, evaluate_population
+
+# --- 初期集団のシード設定 ---
+# 第1世代のうちシードで埋める割合
+SEED_FRACTION = 0.2
+# 極の候補数 (重心そのもの + 重心の外接矩形を広げた範囲からのサンプル)
+NUM_POLE_CANDIDATES = 400
+POLE_MARGIN = 0.25
+# 回帰で得た b をこの範囲に丸める (探索範囲より少し広め)
+SEED_B_RANGE = (0.05, 1.0)
+
+
+def _pole_candidates(points, image_shape, n_poles, rng):
+    """
+    重心群の外接矩形を少し広げた範囲から極の候補を作る。各重心とその平均も候補に含める
+    (重心が n_poles 個以上あれば、そのうち n_poles - 1 個を選んで候補にする)。
+    """
+    h, w = image_shape
+    lows, highs = points.min(axis=0), points.max(axis=0)
+    margin = np.maximum((highs - lows) * POLE_MARGIN, [w * 0.05, h * 0.05])
+    mean = points.mean(axis=0, keepdims=True)
+    if len(points) >= n_poles:
+        points = points[np.sort(rng.choice(len(points), n_poles - 1, replace=False))]
+    n_random = max(0, n_poles - len(points) - 1)
+    random_poles = rng.uniform(lows - margin, highs + margin, size=(n_random, 2))
+    return np.vstack((points, mean, random_poles))
+
+
+def fit_spirals_to_poles(points, poles, chirality=1.0):
+    """
+    各極について、重心を半径順に並べて偏角を単調増加になるよう展開し、
+    log r = log a + b·θ を最小二乗で当てはめる。戻り値は (極の数×6) の [cx, cy, a, b, rotation, chirality]。
+    chirality=-1 なら偏角の符号を反転してから展開し、鏡像の向きの螺旋を当てはめる (rotation は 0)。
+    """
+    dx = points[:, 0] - poles[:, 0, None]
+    dy = points[:, 1] - poles[:, 1, None]
+    radius = np.maximum(np.hypot(dx, dy), 1e-6)
+    order = np.argsort(radius, axis=1)
+    radius = np.take_along_axis(radius, order, axis=1)
+    phi = np.take_along_axis(chirality * np.arctan2(dy, dx), order, axis=1)
+
+    # 半径が大きくなるほど偏角も進むように、前の点からの差を [0, 2π) に入れて積み上げる
+    theta = np.empty_like(phi)
+    theta[:, 0] = phi[:, 0]
+    for i in range(1, phi.shape[1]):
+        theta[:, i] = theta[:, i - 1] + np.mod(phi[:, i] - theta[:, i - 1], 2 * np.pi)
+    # θ の中心がサンプリング範囲 [-4π, 4π] の中央に来るよう 2π の倍数だけずらす
+    theta -= 2 * np.pi * np.round(theta.mean(axis=1, keepdims=True) / (2 * np.pi))
+
+    log_r = np.log(radius)
+    theta_c = theta - theta.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = (theta_c * (log_r - log_r.mean(axis=1, keepdims=True))).sum(axis=1) / (theta_c ** 2).sum(axis=1)
+    b = np.clip(np.nan_to_num(b, nan=SEED_B_RANGE[0]), *SEED_B_RANGE)
+    log_a = log_r.mean(axis=1) - b * theta.mean(axis=1)
+
+    spirals = np.empty((len(poles), len(PARAM_NAMES)))
+    spirals[:, CX], spirals[:, CY] = poles[:, 0], poles[:, 1]
+    spirals[:, A] = np.clip(np.exp(log_a), MIN_A_THRESHOLD, None)
+    spirals[:, B] = b
+    spirals[:, ROT], spirals[:, CHIR] = 0.0, chirality
+    return spirals
+
+
+def seed_spirals(points, image_shape, n_seeds, b_penalty_weight, metric='sampled', rng=None):
+    """
+    重心の配置から解析的にもっともらしい螺旋を作り、スコアの良い順に n_seeds 個返す。
+    各極について両方の向きの螺旋を当てはめ、まとめて1回で採点する。
+    points に PointGrid を渡すと、当てはめにはセルの代表点を使い、採点はインデックスのまま行う。
+    rng (np.random.Generator) を固定すれば結果も決定的になる。
+    戻り値は (seeds, evaluations): seeds は (n×6) の配列、evaluations は採点に使った評価回数。
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    centers, _ = weighted_points(points)
+    if n_seeds <= 0 or len(centers) < 2:
+        return np.empty((0, len(PARAM_NAMES))), 0
+
+    poles = _pole_candidates(centers, image_shape, NUM_POLE_CANDIDATES, rng)
+    spirals = np.vstack([fit_spirals_to_poles(centers, poles, chirality) for chirality in (1.0, -1.0)])
+    scores = evaluate_population(spirals, points, image_shape, b_penalty_weight, metric)
+    best = np.argsort(scores, kind='stable')[:n_seeds]
+    best = best[np.isfinite(scores[best])]
+    return spirals[best], len(spirals)
@@ -0,0 +1,128 @@
+# python_server/sequence.py
+# 動画・連写などの連続したフレームを1枚ずつ読み込み、前のフレームの結果を引き継いで分析するための部品
+
+import os
+import cv2
+import numpy as np
+
+from preprocessing import smart_resize, decode_image
+from spiral_fit import PARAM_NAMES, mutation_sigmas, params_to_array, optimize_spiral_with_golden_ratio
+
+# --- 連続フレームの設定 ---
+# CHANGE_THRESHOLD: 最後に重心を抽出したフレームとの差 (frame_change, 0〜1) がこれを超えたら抽出し直す
+# 目安 (960×640 の合成画像): JPEG の再圧縮 0.01〜0.03 / 2px の平行移動 0.06 / 8px 0.23 / 無関係な画像 0.5
+CHANGE_THRESHOLD = 0.05
+# SCENE_CUT_THRESHOLD: これを超えたら前の螺旋を引き継がず、通常の探索からやり直す
+SCENE_CUT_THRESHOLD = 0.35
+THUMBNAIL_SIZE = 64
+# 前のフレームのベストの周りだけを探す短い GA
+TRACK_CANDIDATES = 60
+TRACK_GENERATIONS = 15
+TRACK_PATIENCE = 5
+TRACK_SIGMA_SCALE = 0.2
+TRACK_BOX_SIGMAS = 3.0
+
+# 1ファイルの動画として扱う拡張子 (それ以外は画像として1枚1フレームで読む)
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+
+
+def iter_video_frames(path, max_dim, frame_step=1):
+    """
+    動画を先頭から1フレームずつデコードし、(フレーム番号, 秒, 長辺 max_dim 以下の画像) を返す。
+    保持するのは常に1フレームだけ。frame_step フレームごとに1枚だけデコードし、間のフレームは読み飛ばす。
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"動画を読み込めませんでした: {os.path.basename(path)}")
+    try:
+        index = 0
+        while capture.grab():
+            if index % frame_step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    raise ValueError(f"フレーム {index} をデコードできませんでした。")
+                yield index, capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, smart_resize(frame, max_dim)
+            index += 1
+    finally:
+        capture.release()
+
+
+def iter_image_frames(paths, max_dim, frame_step=1):
+    """連写などの画像ファイルを順に1枚ずつデコードし、(フレーム番号, None, 画像) を返す"""
+    for index, path in enumerate(paths):
+        if index % frame_step:
+            continue
+        with open(path, "rb") as f:
+            image = decode_image(f.read(), max_dim)
+        if image is None:
+            raise ValueError(f"画像を読み込めませんでした: {os.path.basename(path)}")
+        yield index, None, image
+
+
+def iter_frames(paths, max_dim, frame_step=1):
+    """ファイルが1つで動画の拡張子なら動画として、それ以外は画像の列として読む"""
+    if len(paths) == 1 and paths[0].lower().endswith(VIDEO_EXTENSIONS):
+        return iter_video_frames(paths[0], max_dim, frame_step)
+    return iter_image_frames(paths, max_dim, frame_step)
+
+
+def thumbnail(image):
+    """フレーム差の計算に使う、縦横比を無視した小さなグレースケール画像 (0〜1)"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+
+
+def frame_change(reference, current):
+    """
+    2つのサムネイルの差 (0〜1)。平均を引いてから差を取り、両方の画像の「平均からのずれ」の合計で割る。
+    背景が大半を占める画像でも物体の動きに反応し、全体の明るさの変化には反応しない。
+    """
+    reference, current = reference - reference.mean(), current - current.mean()
+    energy = np.abs(reference).sum() + np.abs(current).sum()
+    return float(np.abs(reference - current).sum() / energy) if energy > 0 else 0.0
+
+
+def track_spiral(points, image_shape, b_penalty_weight, previous_params, metric='sampled', deadline=None, rng=None):
+    """
+    前のフレームのベスト (previous_params) とその周りの小さな集団から始め、
+    その周り (変異の幅の TRACK_BOX_SIGMAS 倍) だけを短い GA で探す。戻り値は (best_params, stats)。
+    範囲が狭いので螺旋の向きは前のフレームのまま引き継がれる。
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    center = params_to_array([previous_params])[0]
+    sigmas = mutation_sigmas(image_shape) * TRACK_SIGMA_SCALE
+    search_ranges = {name: [center[i] - TRACK_BOX_SIGMAS * sigmas[i], center[i] + TRACK_BOX_SIGMAS * sigmas[i]]
+                     for i, name in enumerate(PARAM_NAMES)}
+    initial_population = np.vstack((center, rng.normal(center, sigmas, size=(TRACK_CANDIDATES // 4, len(PARAM_NAMES)))))
+    best_params, stats = optimize_spiral_with_golden_ratio(
+        points, image_shape, b_penalty_weight, metric, patience=TRACK_PATIENCE, deadline=deadline,
+        generations=TRACK_GENERATIONS, n_candidates=TRACK_CANDIDATES, initial_population=initial_population,
+        rng=rng, search_ranges=search_ranges, sigmas=sigmas)
+    stats['optimizer'] = 'track'
+    return best_params or dict(previous_params), stats
+
+
+class TrackSummary:
+    """フレームごとの結果を1件ずつ受け取って集計する (フレーム数によらず一定のメモリ)"""
+
+    def __init__(self):
+        self.frames, self.errors, self.reextracted, self.evaluations = 0, 0, 0, 0
+        self.score_sum, self.score_min, self.score_max = 0.0, None, None
+
+    def add(self, record):
+        self.frames += 1
+        if "error" in record:
+            self.errors += 1
+            return
+        score = record["score"]
+        self.reextracted += int(record["reextracted"])
+        self.evaluations += record["search"]["evaluations"]
+        self.score_sum += score
+        self.score_min = score if self.score_min is None else min(self.score_min, score)
+        self.score_max = score if self.score_max is None else max(self.score_max, score)
+
+    def as_dict(self):
+        scored = self.frames - self.errors
+        return {"frames": self.frames, "errors": self.errors, "reextracted": self.reextracted,
+                "evaluations": self.evaluations, "mean_score": round(self.score_sum / scored, 2) if scored else None,
+                "min_score": self.score_min, "max_score": self.score_max}
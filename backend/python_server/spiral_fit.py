@@ -1,7 +1,13 @@
 # python_server/spiral_fit.py
 
+import time
+import logging
 import numpy as np
 
+from spatial_index import weighted_points
+
+logger = logging.getLogger(__name__)
+
 # --- アルゴリズム用の設定項目 ---
 NUM_GENERATIONS = 80
 NUM_CANDIDATES = 250
@@ -9,57 +15,351 @@ N_ELITES = 15
 MUTATION_RATE = 0.25
 MIN_A_THRESHOLD = 15.0
 GOLDEN_B = 0.30635 
+# 早期終了: ベストスコアが MIN_IMPROVEMENT 以上改善しない世代が STALL_PATIENCE 回続いたら打ち切る
+STALL_PATIENCE = 25
+MIN_IMPROVEMENT = 0.01
 # ★★★ B_PENALTY_WEIGHT の固定値定義を削除 ★★★
 
-def calculate_composition_score(candidate_params, points, image_shape):
-    # ... (この関数は変更なし) ...
+# --- ベクトル化スコアリング用の設定項目 ---
+# 候補は (N×6) の配列 [cx, cy, a, b, rotation, chirality] として保持する
+# 螺旋上の点の偏角は chirality·θ + rotation (r = a·e^{bθ})。chirality は符号だけを使い (0以上で +1, 負で -1)、
+# GA の変異で向きが入れ替われるよう連続値の遺伝子として持つ。+1 が従来の螺旋 (数式の座標系で反時計回り)
+PARAM_NAMES = ('cx', 'cy', 'a', 'b', 'rotation', 'chirality')
+CX, CY, A, B, ROT, CHIR = range(len(PARAM_NAMES))
+# 回転と向きを持たない古いパラメータ辞書を読むときの既定値
+PARAM_DEFAULTS = {'rotation': 0.0, 'chirality': 1.0}
+# 外側へたどったときに画像 (y 軸が下向き) の上で回る向き
+ORIENTATIONS = {1: 'clockwise', -1: 'counterclockwise'}
+THETA_SAMPLES = 200
+MIN_VISIBLE_SAMPLES = 10
+# 1チャンクあたりの (候補数 × 点数 × θ数) の上限。メモリ使用量を抑えるため
+MAX_BROADCAST_ELEMENTS = 2_000_000
+# analytic 方式の可視弧チェックで、部分的に見える半径帯を分ける区間の数 (多いほど sampled の判定に近いが重い)
+VISIBLE_ARC_SEGMENTS = 4
+# 画面の右・下・左・上の辺の外向き法線の偏角 (y 軸は下向き)。隣り合う辺の法線は π/2 ずつ離れている
+EDGE_NORMALS = np.array([0.0, 0.5, 1.0, 1.5]) * np.pi
+_THETA_TABLES = {}
+
+def theta_table(samples=THETA_SAMPLES):
+    """全候補で共有する (θ, cosθ, sinθ) のテーブル。サンプル数ごとに1回だけ作る"""
+    if samples not in _THETA_TABLES:
+        theta = np.linspace(-np.pi * 4, np.pi * 4, samples)
+        _THETA_TABLES[samples] = (theta, np.cos(theta), np.sin(theta))
+    return _THETA_TABLES[samples]
+
+def min_visible_samples(samples=THETA_SAMPLES):
+    """可視サンプル数の下限。θを粗くしても同じ長さの弧を要求するよう、サンプル数に比例させる"""
+    return MIN_VISIBLE_SAMPLES * samples / THETA_SAMPLES
+
+# calculate_composition_score と同じサンプリング
+THETA, COS_THETA, SIN_THETA = theta_table()
+
+def chirality_sign(chirality):
+    """chirality の遺伝子を向きの符号 (+1 / -1) にする"""
+    return np.where(np.asarray(chirality) < 0, -1.0, 1.0)
+
+def spiral_orientation(params):
+    """パラメータ辞書の向きを ORIENTATIONS の名前で返す"""
+    return ORIENTATIONS[int(chirality_sign(params.get('chirality', PARAM_DEFAULTS['chirality'])))]
+
+def calculate_composition_score(candidate_params, points, image_shape, weights=None):
+    """
+    1つの螺旋について、各点から螺旋上の最も近い画面内のサンプルまでの距離の平均を返す。
+    points は (N×2) の配列か PointGrid (セルの代表点について重み付き平均を取る)。
+    weights (N,) を渡すと、配列の点ごとの重みで平均する。
+    """
+    points, cell_weights = weighted_points(points)
+    if weights is None: weights = cell_weights
     h, w = image_shape
     cx, cy, a, b = candidate_params['cx'], candidate_params['cy'], candidate_params['a'], candidate_params['b']
+    rotation = candidate_params.get('rotation', PARAM_DEFAULTS['rotation'])
+    chirality = chirality_sign(candidate_params.get('chirality', PARAM_DEFAULTS['chirality']))
     theta = np.linspace(-np.pi * 4, np.pi * 4, 200)
     r = a * np.exp(b * theta)
-    x_fit, y_fit = cx + r * np.cos(theta), cy + r * np.sin(theta)
+    angle = chirality * theta + rotation
+    x_fit, y_fit = cx + r * np.cos(angle), cy + r * np.sin(angle)
     valid_mask = (x_fit >= 0) & (x_fit < w) & (y_fit >= 0) & (y_fit < h)
     spiral_points = np.vstack((x_fit[valid_mask], y_fit[valid_mask])).T
     if len(spiral_points) < 10: return float('inf')
-    total_distance = sum(np.min(np.sqrt(np.sum((spiral_points - p)**2, axis=1))) for p in points)
-    return total_distance / len(points)
+    distances = [np.min(np.sqrt(np.sum((spiral_points - p)**2, axis=1))) for p in points]
+    return float(np.average(distances, weights=weights))
+
+def params_to_array(params_list):
+    """パラメータ辞書のリストを (N×6) の配列に変換する (rotation / chirality が無ければ PARAM_DEFAULTS を使う)"""
+    return np.array([[p.get(name, PARAM_DEFAULTS.get(name)) for name in PARAM_NAMES] for p in params_list],
+                    dtype=float).reshape(-1, len(PARAM_NAMES))
+
+def array_to_params(row):
+    """(6,) の配列をパラメータ辞書に戻す。rotation は [0, 2π) に、chirality は +1 / -1 にそろえる"""
+    params = {name: float(row[i]) for i, name in enumerate(PARAM_NAMES)}
+    params['rotation'] = float(np.mod(params['rotation'], 2 * np.pi))
+    params['chirality'] = float(chirality_sign(params['chirality']))
+    return params
+
+def _sample_spirals(block, image_shape, theta_samples=THETA_SAMPLES):
+    """候補 (M×6) ごとに共有θテーブルの螺旋上の点 (M×θ数) と、それが画面内にあるかのマスクを返す"""
+    h, w = image_shape
+    theta, cos_theta, sin_theta = theta_table(theta_samples)
+    r = block[:, A, None] * np.exp(block[:, B, None] * theta)
+    # cos(sθ + rot), sin(sθ + rot) を共有の cosθ, sinθ から作る
+    cos_rot, sin_rot = np.cos(block[:, ROT, None]), np.sin(block[:, ROT, None])
+    s_sin_theta = chirality_sign(block[:, CHIR, None]) * sin_theta
+    x_fit = block[:, CX, None] + r * (cos_theta * cos_rot - s_sin_theta * sin_rot)
+    y_fit = block[:, CY, None] + r * (s_sin_theta * cos_rot + cos_theta * sin_rot)
+    return x_fit, y_fit, (x_fit >= 0) & (x_fit < w) & (y_fit >= 0) & (y_fit < h)
+
+def calculate_population_scores(population, points, image_shape, theta_samples=THETA_SAMPLES):
+    """
+    calculate_composition_score のベクトル化版。
+    (N×6) の候補全体を、共有θテーブルと全重心に対して一度のブロードキャストで評価する。
+    回転と向きは cos/sin の加法定理で候補ごとの係数にするので、両方の向きの候補が同じブロードキャストに混在できる。
+    画面外のサンプルはマスクして最小値から除外し、可視サンプルが足りない候補は距離を計算せずに inf を返す。
+    theta_samples を減らすと粗く安く評価できる (粗密探索の粗い段階で使う)。
+    points に PointGrid を渡すと、セルの代表点までの距離を重み付きで平均する (点数によらずセル数で計算量が決まる)。
+    """
+    population = np.atleast_2d(np.asarray(population, dtype=float))
+    points, weights = weighted_points(points)
+    px, py = points[:, 0, None], points[:, 1, None]
+    scores = np.full(len(population), np.inf)
+    if len(points) == 0:
+        return scores
+
+    chunk = max(1, MAX_BROADCAST_ELEMENTS // (len(points) * theta_samples))
+    with np.errstate(over='ignore', invalid='ignore'):
+        for start in range(0, len(population), chunk):
+            x_fit, y_fit, valid = _sample_spirals(population[start:start + chunk], image_shape, theta_samples)
+            # 画面内の弧が短すぎる候補は、重い距離の計算に入れない
+            visible = np.flatnonzero(valid.sum(axis=1) >= min_visible_samples(theta_samples))
+            if len(visible) == 0:
+                continue
+            x_fit, y_fit, valid = x_fit[visible], y_fit[visible], valid[visible]
+
+            # (候補, 点, θ) の距離の2乗。画面外のサンプルは inf にして最小値から外す
+            d2 = (x_fit[:, None, :] - px) ** 2 + (y_fit[:, None, :] - py) ** 2
+            d2 = np.where(valid[:, None, :], d2, np.inf)
+            scores[start + visible] = np.average(np.sqrt(d2.min(axis=2)), axis=1, weights=weights)
+    return scores
+
+def _estimate_visible_samples(population, image_shape, theta_samples=THETA_SAMPLES):
+    """
+    θサンプルのうち画面内に入る数を、曲線を生成せずに閉形式で見積もる (解析的な可視弧チェック)。
+    極が画面内なら、最も近い辺までの半径 d_full より内側のθ幅はすべて画面内に数える。
+    その外側から最も遠いコーナーまでの半径帯は VISIBLE_ARC_SEGMENTS 個のθ区間に分け、区間の中点半径の円で
+    各辺の外に出る弧 (外向き法線 ± arccos(辺までの距離 / 半径)) を求めて、偏角 s·θ + rotation が
+    その弧に入らないθ幅を周期ごとの閉形式で数える。向かい合う辺の弧は重ならないので、弧の和集合は
+    4本の弧の長さから隣り合う辺の弧の重なりを引けば求まる。
+    d_full より内側だけで下限に届く候補と、半径帯をすべて画面内と数えても届かない候補は弧を計算しない。
+    """
+    h, w = image_shape
+    population = np.atleast_2d(np.asarray(population, dtype=float))
+    cx, cy, a, b, rotation = (population[:, i] for i in (CX, CY, A, B, ROT))
+    # 各辺までの符号付き距離 (極が辺の内側なら正)。EDGE_NORMALS と同じ順
+    edges = np.column_stack((w - cx, h - cy, cx, cy))
+    corners_x, corners_y = np.array([0.0, w, w, 0.0]), np.array([0.0, 0.0, h, h])
+    d_near = np.hypot(np.clip(cx, 0, w) - cx, np.clip(cy, 0, h) - cy)
+    d_far = np.hypot(corners_x - cx[:, None], corners_y - cy[:, None]).max(axis=1)
+    d_full = np.maximum(edges.min(axis=1), 0.0)
+    step = (THETA[-1] - THETA[0]) / (theta_samples - 1)
+    needed = min_visible_samples(theta_samples) * step
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        def theta_at(radius):
+            # r = a·e^{bθ} を解いて [-4π, 4π] にクリップする
+            return np.clip(np.log(radius / a) / b, THETA[0], THETA[-1])
+
+        inner_end = np.where(b > 0, THETA[0], THETA[-1])
+        full = np.where(d_full > 0, np.abs(theta_at(d_full) - inner_end), 0.0)
+        t_start, t_end = theta_at(np.maximum(d_near, d_full)), theta_at(d_far)
+    full = np.where(np.isfinite(full), full, 0.0)
+    band = np.where(np.isfinite(t_start) & np.isfinite(t_end), np.abs(t_end - t_start), 0.0)
+    visible = full.copy()
+    partial = np.flatnonzero((full < needed) & (full + band >= needed))
+    if len(partial) == 0:
+        return visible / step
+
+    a, b, rotation, edges = a[partial, None], b[partial, None], rotation[partial, None], edges[partial]
+    sign = chirality_sign(population[partial, CHIR, None])
+    t_start, t_end = t_start[partial, None], t_end[partial, None]
+    bounds = t_start + (t_end - t_start) * (np.arange(VISIBLE_ARC_SEGMENTS + 1) / VISIBLE_ARC_SEGMENTS)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # 区間ごと・辺ごとに、中点半径の円が辺の外に出る弧 [lo, hi] (候補×区間×辺)
+        radius = a * np.exp(b * (bounds[:, :-1] + bounds[:, 1:]) / 2)
+        half = np.arccos(np.clip(edges[:, None, :] / radius[..., None], -1, 1))
+        lo, hi = EDGE_NORMALS - half, EDGE_NORMALS + half
+        # 隣の辺 (上の次は 2π 先の右) の弧との重なり
+        next_edge, wrap = [1, 2, 3, 0], np.array([0.0, 0.0, 0.0, 2 * np.pi])
+        overlap_lo = np.maximum(lo, lo[..., next_edge] + wrap)
+        overlap_len = np.maximum(np.minimum(hi, hi[..., next_edge] + wrap) - overlap_lo, 0.0)
+        arc_lo = np.concatenate((lo, overlap_lo), axis=2)[..., None, :]
+        arc_len = np.concatenate((2 * half, overlap_len), axis=2)[..., None, :]
+        arc_sign = np.repeat([1.0, -1.0], len(EDGE_NORMALS))
+
+        # 偏角 φ = s·θ + rotation が弧を通る累積の長さ (周回数 × 弧長 + 最後の周の分) を区間の両端で求める
+        phi = sign[..., None] * np.stack((bounds[:, :-1], bounds[:, 1:]), axis=2) + rotation[..., None]
+        offset = phi[..., None] - arc_lo
+        turns = np.floor(offset / (2 * np.pi))
+        swept = ((turns * arc_len + np.minimum(offset - turns * 2 * np.pi, arc_len)) * arc_sign).sum(axis=3)
+        outside = np.abs(swept[..., 1] - swept[..., 0])
+        inside = np.clip(np.abs(bounds[:, 1:] - bounds[:, :-1]) - outside, 0, None).sum(axis=1)
+    visible[partial] += np.where(np.isfinite(inside), inside, 0.0)
+    return visible / step
+
+def calculate_population_scores_analytic(population, points, image_shape, theta_samples=THETA_SAMPLES):
+    """
+    曲線をサンプリングしない解析的な距離スコア。
+    重心を (cx, cy) 周りの対数極座標に変換すると対数螺旋は直線になるので、
+    同じ偏角を通る最も近い巻き (θ = s(φ - rotation) + 2πn, s は向きの符号) を閉形式で求め、半径方向のずれを
+    螺旋の法線方向の距離 |Δr| / sqrt(1 + b²) に換算する。θ範囲の両端の点までの距離も候補に含める。
+    距離の計算量は候補あたり O(点数)。可視性は曲線を作らない _estimate_visible_samples で先に判定し、
+    足りない候補は距離を計算しない (θサンプル数は可視性の判定にだけ使う)。判定は sampled 方式の近似なので、
+    可視サンプル数が下限に近い候補では有効・無効が食い違うことがある。points に PointGrid を渡すと、セルの代表点までの距離を重み付きで平均する。
+    """
+    population = np.atleast_2d(np.asarray(population, dtype=float))
+    points, weights = weighted_points(points)
+    scores = np.full(len(population), np.inf)
+    if len(points) == 0:
+        return scores
+    visible = np.flatnonzero(_estimate_visible_samples(population, image_shape, theta_samples) >= min_visible_samples(theta_samples))
+    if len(visible) == 0:
+        return scores
+
+    cx, cy, a, b, rotation = (population[visible, i, None] for i in (CX, CY, A, B, ROT))
+    chirality = chirality_sign(population[visible, CHIR, None])
+    dx, dy = points[:, 0] - cx, points[:, 1] - cy
+    # 偏角を螺旋自身のθの向きと原点に合わせる
+    rho, phi = np.hypot(dx, dy), chirality * (np.arctan2(dy, dx) - rotation)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # log r = log a + b(φ + 2πn) を満たす連続な n
+        n_cont = (np.log(rho / a) / b - phi) / (2 * np.pi)
+        n_min = np.ceil((THETA[0] - phi) / (2 * np.pi))
+        n_max = np.floor((THETA[-1] - phi) / (2 * np.pi))
+        radial_gap = np.full(rho.shape, np.inf)
+        for n in (np.floor(n_cont), np.ceil(n_cont)):
+            n = np.clip(n, n_min, n_max)
+            r_n = a * np.exp(b * (phi + 2 * np.pi * n))
+            radial_gap = np.fmin(radial_gap, np.abs(rho - r_n))
+        distance = radial_gap / np.sqrt(1 + b ** 2)
+
+        # 螺旋の両端 (θ = ±4π) までの直線距離
+        for theta_end in (THETA[0], THETA[-1]):
+            r_end, end_angle = a * np.exp(b * theta_end), chirality * theta_end + rotation
+            end_dist = np.hypot(dx - r_end * np.cos(end_angle), dy - r_end * np.sin(end_angle))
+            distance = np.fmin(distance, end_dist)
+
+        visible_scores = np.average(distance, axis=1, weights=weights)
+    scores[visible] = np.where(np.isfinite(visible_scores), visible_scores, np.inf)
+    return scores
+
+# スコアリング方式 ('sampled': θをサンプリングする従来方式, 'analytic': 対数極座標での閉形式)
+SCORING_METRICS = {
+    'sampled': calculate_population_scores,
+    'analytic': calculate_population_scores_analytic,
+}
+
+def evaluate_population(population, points, image_shape, b_penalty_weight, metric='sampled', theta_samples=THETA_SAMPLES):
+    """距離スコアに黄金比ペナルティを加えた最終スコアを候補全体について計算する"""
+    if metric not in SCORING_METRICS:
+        raise ValueError(f"未知のスコアリング方式です: {metric}")
+    population = np.atleast_2d(population)
+    scores = SCORING_METRICS[metric](population, points, image_shape, theta_samples)
+    scores = scores + b_penalty_weight * (population[:, B] - GOLDEN_B) ** 2
+    scores[~(population[:, A] >= MIN_A_THRESHOLD)] = np.inf
+    return scores
+
+def mutation_sigmas(image_shape):
+    """変異の標準偏差 (cx, cy, a, b, rotation, chirality)"""
+    h, w = image_shape
+    return np.array([w * 0.1, h * 0.1, 20.0, 0.05, 0.2, 0.5])
+
+def get_search_ranges(image_shape):
+    """螺旋パラメータの探索範囲 (画面の外側1画面分まで極を探す。両方の向きを同じ集団で探す)"""
+    h, w = image_shape
+    return {'cx': [-w, 2*w], 'cy': [-h, 2*h], 'a': [10.0, 400.0], 'b': [0.1, 0.5],
+            'rotation': [0.0, 2 * np.pi], 'chirality': [-1.0, 1.0]}
+
+def _random_population(n, search_ranges, rng):
+    lows = np.array([search_ranges[name][0] for name in PARAM_NAMES])
+    highs = np.array([search_ranges[name][1] for name in PARAM_NAMES])
+    return rng.uniform(lows, highs, size=(n, len(PARAM_NAMES)))
 
 # ★★★ 関数の引数に `b_penalty_weight` を追加 ★★★
-def optimize_spiral_with_golden_ratio(points, image_shape, b_penalty_weight):
+# ★★★ 停滞判定 (patience, min_delta) と締め切り (deadline: time.monotonic() の時刻) を追加 ★★★
+# ★★★ 粗密探索のため、探索範囲・変異の幅・θサンプル数を外から指定できるようにした ★★★
+def optimize_spiral_with_golden_ratio(points, image_shape, b_penalty_weight, metric='sampled',
+                                      patience=STALL_PATIENCE, min_delta=MIN_IMPROVEMENT, deadline=None,
+                                      generations=NUM_GENERATIONS, n_candidates=NUM_CANDIDATES,
+                                      initial_population=None, rng=None, progress_callback=None,
+                                      search_ranges=None, sigmas=None, theta_samples=THETA_SAMPLES):
+    """
+    遺伝的アルゴリズムで螺旋パラメータを探索する。
+    patience 世代続けて min_delta 以上改善しない場合、または deadline を過ぎた場合は
+    その時点のベストを返す (patience=None で停滞判定を無効化)。
+    initial_population ((M×6) の配列) を渡すと第1世代の先頭をそれで埋め、残りを一様乱数で補う。
+    rng (np.random.Generator) を固定すれば探索は決定的になる。
+    progress_callback(generation, best_params, best_score) は毎世代呼ばれ、True を返すと探索を中断する。
+    search_ranges / sigmas (省略時は get_search_ranges / mutation_sigmas) で乱数で補う範囲と変異の幅を、
+    theta_samples で評価に使うθの数を変えられる。
+    戻り値は (best_params, stats)。stats には実際に使った世代数・評価回数・終了理由が入る。
+    """
+    best_params, stats, _ = genetic_search(points, image_shape, b_penalty_weight, metric, patience, min_delta, deadline,
+                                           generations, n_candidates, initial_population, rng, progress_callback,
+                                           search_ranges, sigmas, theta_samples)
+    return best_params, stats
+
+def genetic_search(points, image_shape, b_penalty_weight, metric='sampled',
+                   patience=STALL_PATIENCE, min_delta=MIN_IMPROVEMENT, deadline=None,
+                   generations=NUM_GENERATIONS, n_candidates=NUM_CANDIDATES,
+                   initial_population=None, rng=None, progress_callback=None,
+                   search_ranges=None, sigmas=None, theta_samples=THETA_SAMPLES):
+    """
+    optimize_spiral_with_golden_ratio の本体。(best_params, stats, elites) を返す。
+    elites は最後に評価した世代の上位 N_ELITES 個 ((M×6) の配列, スコア順で、無効な候補は除く)。
+    エリートは次の世代に必ず残るので、全体のベストも含まれる。
+    """
     h, w = image_shape
-    search_ranges = {'cx': [-w, 2*w], 'cy': [-h, 2*h], 'a': [10.0, 400.0], 'b': [0.1, 0.5]}
-    
-    candidates = []
-    for _ in range(NUM_CANDIDATES):
-        candidates.append({'cx': np.random.uniform(*search_ranges['cx']),'cy': np.random.uniform(*search_ranges['cy']),'a': np.random.uniform(*search_ranges['a']),'b': np.random.uniform(*search_ranges['b'])})
+    search_ranges = get_search_ranges(image_shape) if search_ranges is None else search_ranges
+    sigmas = mutation_sigmas(image_shape) if sigmas is None else np.asarray(sigmas, dtype=float)
 
+    rng = np.random.default_rng() if rng is None else rng
+    seeds = np.empty((0, len(PARAM_NAMES))) if initial_population is None else np.asarray(initial_population, dtype=float)[:n_candidates]
+    candidates = np.vstack((seeds, _random_population(n_candidates - len(seeds), search_ranges, rng)))
     best_overall_params, best_overall_score = {}, float('inf')
+    elites, elite_scores = np.empty((0, len(PARAM_NAMES))), np.empty(0)
+    stats = {'generations': 0, 'evaluations': 0, 'stop_reason': 'completed'}
+    stalled_generations, last_improved_score = 0, float('inf')
 
-    for generation in range(NUM_GENERATIONS):
-        scores = []
-        for params in candidates:
-            if params['a'] < MIN_A_THRESHOLD:
-                scores.append(float('inf'))
-                continue
-            
-            distance_score = calculate_composition_score(params, points, (h, w))
-            b_penalty = (params['b'] - GOLDEN_B)**2
-            
-            # ★★★ 固定値の代わりに引数を使う ★★★
-            final_score = distance_score + b_penalty_weight * b_penalty
-            scores.append(final_score)
-        
-        # ... (以降の最適化ループは変更なし) ...
-        sorted_candidates = sorted(zip(scores, candidates), key=lambda x: x[0])
-        if sorted_candidates[0][0] < best_overall_score:
-            best_overall_score, best_overall_params = sorted_candidates[0][0], sorted_candidates[0][1]
-        elites = [c for s, c in sorted_candidates[:N_ELITES]]
-        next_generation = elites[:]
-        num_mutations = int(NUM_CANDIDATES * MUTATION_RATE)
-        for _ in range(num_mutations): next_generation.append({'cx': np.random.uniform(*search_ranges['cx']), 'cy': np.random.uniform(*search_ranges['cy']), 'a': np.random.uniform(*search_ranges['a']), 'b': np.random.uniform(*search_ranges['b'])})
-        num_offspring = NUM_CANDIDATES - len(next_generation)
-        for i in range(num_offspring): parent = elites[i % len(elites)]; next_generation.append({'cx': np.random.normal(parent['cx'], w * 0.1), 'cy': np.random.normal(parent['cy'], h * 0.1), 'a': np.random.normal(parent['a'], 20.0), 'b': np.random.normal(parent['b'], 0.05)})
-        candidates = next_generation
-        if (generation + 1) % 10 == 0: print(f"世代 {generation+1}/{NUM_GENERATIONS}: ベストスコア = {best_overall_score:.4f} (b={best_overall_params.get('b', 0):.4f})")
-    
-    return best_overall_params
\ No newline at end of file
+    for generation in range(generations):
+        # ★★★ 候補全体を一括で評価する ★★★
+        scores = evaluate_population(candidates, points, (h, w), b_penalty_weight, metric, theta_samples)
+        stats['generations'] += 1
+        stats['evaluations'] += len(candidates)
+
+        order = np.argsort(scores, kind='stable')
+        elites, elite_scores = candidates[order[:N_ELITES]], scores[order[:N_ELITES]]
+        if scores[order[0]] < best_overall_score:
+            best_overall_score, best_overall_params = float(scores[order[0]]), array_to_params(candidates[order[0]])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("GA の世代", extra={"fields": {"generation": generation + 1, "generations": generations,
+                                                      "best_score": round(best_overall_score, 4), "b": round(best_overall_params.get('b', 0), 4)}})
+        if progress_callback is not None and progress_callback(stats['generations'], best_overall_params, best_overall_score):
+            stats['stop_reason'] = 'cancelled'
+            break
+
+        # 停滞と締め切りの判定
+        if best_overall_score < last_improved_score - min_delta:
+            stalled_generations, last_improved_score = 0, best_overall_score
+        else:
+            stalled_generations += 1
+        if patience is not None and stalled_generations >= patience:
+            stats['stop_reason'] = 'stalled'
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            stats['stop_reason'] = 'deadline'
+            break
+
+        num_mutations = int(n_candidates * MUTATION_RATE)
+        num_offspring = n_candidates - len(elites) - num_mutations
+        parents = elites[np.arange(num_offspring) % len(elites)]
+        candidates = np.vstack((elites, _random_population(num_mutations, search_ranges, rng), rng.normal(parents, sigmas)))
+
+    return best_overall_params, stats, elites[np.isfinite(elite_scores)]
@@ -0,0 +1,5 @@
+# テストから python_server のモジュールをそのまま import できるようにする
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
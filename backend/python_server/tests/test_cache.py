@@ -0,0 +1,31 @@
+# python_server/tests/test_cache.py
+# キャッシュのディスク層が disk_max_bytes を超えないよう、最後に使ったのが古いファイルから消すことを確かめる
+
+import os
+
+import numpy as np
+
+from cache import LayeredCache
+
+
+def disk_files(cache):
+    return sorted(os.listdir(cache.disk_dir))
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    value = np.zeros(1000)
+    cache = LayeredCache("features", max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=3 * value.nbytes + 1000)
+    for i, key in enumerate(("a", "b", "c")):
+        cache.put(key, value)
+        # 書き込んだ順に古い更新時刻にしておく
+        os.utime(cache._disk_path(key), (1000.0 + i, 1000.0 + i))
+    assert len(disk_files(cache)) == 3
+
+    # "a" を読むと最近使ったことになり、次に追い出されるのは "b"
+    assert cache.get("a") is not None
+    cache.put("d", value)
+
+    assert not os.path.exists(cache._disk_path("b"))
+    for key in ("a", "c", "d"):
+        assert os.path.exists(cache._disk_path(key))
+    assert sum(os.path.getsize(os.path.join(cache.disk_dir, name)) for name in disk_files(cache)) <= cache.disk_max_bytes
@@ -0,0 +1,48 @@
+# python_server/tests/test_cli.py
+# 一括分析を再開したとき、スコア済みの画像はスキップし、エラーだった画像は古い行を消してやり直すこと
+# (何度再開しても1枚につき1行) を確かめる
+
+import json
+
+import cv2
+import numpy as np
+
+from cli import build_parser, drop_stale_records
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_keeps_one_record_per_image(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(2):
+        image = np.zeros((240, 320, 3), np.uint8)
+        for x, y in rng.uniform((20, 20), (300, 220), size=(10, 2)).astype(int):
+            cv2.circle(image, (int(x), int(y)), 6, (255, 255, 255), -1)
+        cv2.imwrite(str(images / f"good{i}.png"), image)
+    (images / "broken.png").write_bytes(b"not an image")
+    output = tmp_path / "results.jsonl"
+
+    args = build_parser().parse_args(["batch", str(images), "-o", str(output), "--workers", "1",
+                                      "--latency-budget", "0.5", "--seed", "0"])
+    for _ in range(2):
+        assert args.func(args) == 1
+        records = read_records(output)
+        assert sorted(record["file"] for record in records) == ["broken.png", "good0.png", "good1.png"]
+        assert ["error" in record for record in records].count(True) == 1
+
+
+def test_drop_stale_records_removes_retried_and_truncated_lines(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text('{"file": "a.png", "score": 1.0}\n'
+                      '{"file": "b.png", "error": "x", "status_code": 400}\n'
+                      '{"file": "c.png", "error": "y", "status_code": 400}\n'
+                      '{"file": "d.png", "sco', encoding="utf-8")
+    drop_stale_records(str(output), ["b.png", "d.png"])
+
+    # 今回やり直さない画像のエラー行は残す
+    assert [record["file"] for record in read_records(output)] == ["a.png", "c.png"]
@@ -0,0 +1,71 @@
+# python_server/tests/test_scoring.py
+# ベクトル化したスコアリングが、基準の calculate_composition_score と一致すること、
+# analytic 方式が sampled 方式とほぼ同じ候補を有効とし、同じ順位を付けることを確かめる
+
+import numpy as np
+import pytest
+
+from spiral_fit import (PARAM_NAMES, CX, CY, A, B, ROT, CHIR, calculate_composition_score, calculate_population_scores,
+                        calculate_population_scores_analytic, array_to_params)
+
+IMAGE_SHAPE = (480, 640)
+
+
+def random_population(n, rng):
+    """極を画面の外まで広げ、両方の向き・任意の回転を含む候補 (画面外に出て inf になるものも含む)"""
+    h, w = IMAGE_SHAPE
+    population = np.empty((n, len(PARAM_NAMES)))
+    population[:, CX] = rng.uniform(-w, 2 * w, n)
+    population[:, CY] = rng.uniform(-h, 2 * h, n)
+    population[:, A] = rng.uniform(10.0, 400.0, n)
+    population[:, B] = rng.uniform(0.1, 0.5, n)
+    population[:, ROT] = rng.uniform(-2 * np.pi, 4 * np.pi, n)
+    population[:, CHIR] = rng.uniform(-1.0, 1.0, n)
+    return population
+
+
+@pytest.fixture
+def scene():
+    rng = np.random.default_rng(0)
+    points = rng.uniform((0, 0), (IMAGE_SHAPE[1], IMAGE_SHAPE[0]), size=(12, 2))
+    return random_population(400, rng), points
+
+
+def test_population_scores_match_reference(scene):
+    population, points = scene
+    vectorized = calculate_population_scores(population, points, IMAGE_SHAPE)
+    reference = np.array([calculate_composition_score(array_to_params(row), points, IMAGE_SHAPE) for row in population])
+
+    # 両方の向きと画面外の候補が実際に含まれていること
+    assert (population[:, CHIR] < 0).any() and (population[:, CHIR] >= 0).any()
+    assert np.isinf(reference).any() and np.isfinite(reference).any()
+
+    np.testing.assert_array_equal(np.isinf(vectorized), np.isinf(reference))
+    finite = np.isfinite(reference)
+    np.testing.assert_allclose(vectorized[finite], reference[finite], rtol=0, atol=1e-9)
+
+
+def ranks(values):
+    return np.argsort(np.argsort(values))
+
+
+def test_analytic_agrees_with_sampled():
+    rng = np.random.default_rng(0)
+    points = rng.uniform((0, 0), (IMAGE_SHAPE[1], IMAGE_SHAPE[0]), size=(40, 2))
+    population = random_population(2000, rng)
+    sampled = calculate_population_scores(population, points, IMAGE_SHAPE)
+    analytic = calculate_population_scores_analytic(population, points, IMAGE_SHAPE)
+
+    # analytic の可視弧チェックは曲線を作らない近似なので、有効・無効 (inf) の判定は 95% 以上の候補で一致すればよい
+    # (食い違うのは可視サンプル数が下限に近い候補。実測 97.8%)
+    assert np.isinf(sampled).any() and np.isfinite(sampled).any()
+    assert np.mean(np.isinf(analytic) == np.isinf(sampled)) >= 0.95
+    finite = np.isfinite(sampled) & np.isfinite(analytic)
+    assert finite.sum() >= 200
+
+    # analytic は連続な曲線までの距離なので、θサンプル上の最短距離 (sampled) を超えない
+    assert (analytic[finite] <= sampled[finite] + 1e-9).all()
+    # 順位の相関 (Spearman) は 0.95 以上、相対的な差は 90% の候補で 25% 以内 (実測 0.98 / 18%)
+    assert np.corrcoef(ranks(sampled[finite]), ranks(analytic[finite]))[0, 1] >= 0.95
+    relative_gap = (sampled[finite] - analytic[finite]) / sampled[finite]
+    assert np.percentile(relative_gap, 90) <= 0.25
@@ -0,0 +1,59 @@
+# python_server/tests/test_spatial_index.py
+# 空間インデックスがセル数を MAX_GRID_CELLS に抑え、ずれを max_error として正しく報告すること、
+# 1万点の重心でも探索の時間が点の数によらず対話的に使える範囲に収まることを確かめる
+
+import time
+
+import numpy as np
+import pytest
+
+from spatial_index import PointGrid, MAX_GRID_CELLS
+from optimizers import run_optimizer
+
+IMAGE_SHAPE = (1365, 2048)
+# 1万点の探索 (ga の全世代) にかけてよい時間 (秒)。セル数を抑えなければ sampled で数百秒かかる
+SEARCH_TIME_LIMIT = 5.0
+
+
+def test_grid_caps_cell_count_and_reports_error():
+    rng = np.random.default_rng(0)
+    points = rng.uniform((0, 0), IMAGE_SHAPE[::-1], size=(1274, 2))
+    weights = rng.uniform(20.0, 400.0, len(points))
+    grid = PointGrid(points, weights, max_cells=32)
+
+    assert len(grid) <= 32
+    np.testing.assert_allclose(grid.weights.sum(), weights.sum())
+    # max_error は実際に最も遠い点までの距離で、セルの対角線を超えない
+    errors = np.hypot(*(points[:, None, :] - grid.centers[None, :, :]).transpose(2, 0, 1))
+    assert grid.max_error >= errors.min(axis=1).max() - 1e-9
+    assert grid.max_error <= grid.cell_size * np.sqrt(2) + 1e-9
+
+
+def test_sparse_points_keep_their_own_cells():
+    rng = np.random.default_rng(1)
+    points = rng.uniform((100, 100), (140, 140), size=(2000, 2))
+    grid = PointGrid(points, max_cells=32)
+
+    assert len(grid) <= 32
+    assert grid.counts.sum() == len(points)
+
+    few = np.array([[10.0, 10.0], [500.0, 300.0], [900.0, 600.0]])
+    grid = PointGrid(few, max_cells=32)
+    np.testing.assert_allclose(grid.centers, few)
+    assert grid.max_error == 0.0
+
+
+@pytest.mark.parametrize("metric", ["sampled", "analytic"])
+def test_search_time_with_10k_points(metric):
+    rng = np.random.default_rng(2)
+    points = rng.uniform((0, 0), IMAGE_SHAPE[::-1], size=(10000, 2))
+    weights = rng.uniform(20.0, 400.0, len(points))
+
+    start = time.perf_counter()
+    grid = PointGrid(points, weights, MAX_GRID_CELLS[metric])
+    params, _ = run_optimizer('ga', grid, IMAGE_SHAPE, 100.0, metric, seed=0)
+    elapsed = time.perf_counter() - start
+
+    assert len(grid) <= MAX_GRID_CELLS[metric]
+    assert all(np.isfinite(value) for value in params.values())
+    assert elapsed < SEARCH_TIME_LIMIT
@@ -0,0 +1,90 @@
+# python_server/uploads.py
+
+import os
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+# --- アップロードの上限 (環境変数で変更可能) ---
+# MAX_UPLOAD_BYTES: 画像1枚のファイルの上限
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+# MAX_REQUEST_BYTES: 一括分析や動画など、画像1枚以外を受け取るリクエスト本文全体の上限
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", 512 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 画像1枚のリクエストで、ファイル以外 (マルチパートの区切りやフォーム項目) に見込む分
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large(limit):
+    return HTTPException(status_code=413, detail=f"アップロードが大きすぎます (上限 {limit / (1024 * 1024):g} MB)。")
+
+
+async def read_upload(upload: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> bytearray:
+    """
+    アップロードを UPLOAD_CHUNK_SIZE ずつ読んで1つの bytearray に詰める。
+    サイズが分かっていれば読む前に、分からなければ上限を超えた時点で 413 を送出する。
+    """
+    if upload.size is not None and upload.size > limit:
+        raise _too_large(limit)
+    data = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return data
+        if len(data) + len(chunk) > limit:
+            raise _too_large(limit)
+        data += chunk
+
+
+async def save_upload(upload: UploadFile, path: str, limit: int = MAX_REQUEST_BYTES):
+    """アップロードをメモリに溜めずに UPLOAD_CHUNK_SIZE ずつファイルへ書き出す"""
+    if upload.size is not None and upload.size > limit:
+        raise _too_large(limit)
+    written = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            written += len(chunk)
+            if written > limit:
+                raise _too_large(limit)
+            f.write(chunk)
+
+
+class RequestSizeLimitMiddleware:
+    """
+    本文を受け取る前に Content-Length を見て、上限を超えるリクエストにはすぐ 413 を返す。
+    Content-Length が無い (chunked) 場合は受け取ったバイト数を数え、上限を超えた時点で 413 にする。
+    上限はパスごとに limits で指定し、それ以外のパスは default を使う。
+    本文はマルチパートの区切りやフォーム項目の分として overhead まで上限を超えてよいが、413 で伝えるのは上限そのもの。
+    """
+
+    def __init__(self, app, limits: dict, default: int = MAX_REQUEST_BYTES, overhead: int = FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.limits = limits
+        self.default = default
+        self.overhead = overhead
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = self.limits.get(scope["path"], self.default)
+        body_limit = limit + self.overhead
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > body_limit:
+            response = JSONResponse({"detail": _too_large(limit).detail}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > body_limit:
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
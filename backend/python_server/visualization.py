@@ -1,8 +1,72 @@
 import cv2
 import numpy as np
 
-def draw_result(image, initial_centroids, clustered_centroids, spiral_params):
-    final_image = image.copy()
+from spiral_fit import PARAM_DEFAULTS, chirality_sign
+
+# レスポンス画像のエンコード形式ごとの拡張子と品質パラメータ
+IMAGE_FORMATS = {
+    "png": (".png", None, "image/png"),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"),
+}
+# 螺旋の向きを示す矢印 (画面内で最も外側の点に、外へ進む向きで描く) の長さ (px)
+ORIENTATION_ARROW_LENGTH = 40
+
+def spiral_polyline(spiral_params, num_samples=500):
+    """描画に使う螺旋の折れ線 (num_samples×2, int32) を内側から外側の順で返す"""
+    cx, cy, a, b = spiral_params['cx'], spiral_params['cy'], spiral_params['a'], spiral_params['b']
+    rotation = spiral_params.get('rotation', PARAM_DEFAULTS['rotation'])
+    chirality = chirality_sign(spiral_params.get('chirality', PARAM_DEFAULTS['chirality']))
+    theta_fit = np.linspace(-np.pi * 5, np.pi * 5, num_samples)
+    r_fit = a * np.exp(b * theta_fit)
+    angle = chirality * theta_fit + rotation
+    x_fit = cx + r_fit * np.cos(angle)
+    y_fit = cy + r_fit * np.sin(angle)
+    return np.vstack((x_fit, y_fit)).T.astype(np.int32)
+
+def _draw_orientation_arrow(image, fit_points, color, thickness):
+    """画面内で最も外側にある螺旋上の点に、外へ進む向きの矢印を描く (螺旋の向きが一目で分かるように)"""
+    h, w = image.shape[:2]
+    inside = np.flatnonzero((fit_points[:, 0] >= 0) & (fit_points[:, 0] < w) & (fit_points[:, 1] >= 0) & (fit_points[:, 1] < h))
+    if len(inside) < 2:
+        return
+    tip = inside[-1]
+    # 先端から ORIENTATION_ARROW_LENGTH 以上離れた、内側で最も近い点を矢印の根元にする
+    distance = np.hypot(*(fit_points[:tip] - fit_points[tip]).T)
+    far = np.flatnonzero(distance >= ORIENTATION_ARROW_LENGTH)
+    tail = far[-1] if len(far) else 0
+    cv2.arrowedLine(image, tuple(int(v) for v in fit_points[tail]), tuple(int(v) for v in fit_points[tip]), color,
+                    thickness, tipLength=0.5)
+
+def decimated_spiral_polyline(spiral_params, image_shape, epsilon=1.0):
+    """
+    クライアント側で螺旋を描くための間引いた折れ線。
+    画面から大きく外れた部分を落とし、Douglas-Peucker 法で epsilon px 以内の誤差に間引く。
+    """
+    h, w = image_shape
+    points = spiral_polyline(spiral_params)
+    inside = (points[:, 0] > -w) & (points[:, 0] < 2 * w) & (points[:, 1] > -h) & (points[:, 1] < 2 * h)
+    if not inside.any():
+        return np.empty((0, 2), dtype=np.int32)
+    first, last = np.argmax(inside), len(inside) - np.argmax(inside[::-1])
+    return cv2.approxPolyDP(points[first:last].reshape(-1, 1, 2), epsilon, False).reshape(-1, 2)
+
+def encode_image(image, image_format="png", quality=90, as_bytes=True):
+    """
+    画像を指定形式でエンコードし、(バイト列, MIMEタイプ) を返す。
+    as_bytes=False なら bytes に複製せず、エンコード結果の1次元 uint8 配列をそのまま返す。
+    """
+    ext, quality_flag, media_type = IMAGE_FORMATS[image_format]
+    params = [quality_flag, int(quality)] if quality_flag is not None else []
+    _, buffer = cv2.imencode(ext, image, params)
+    return (buffer.tobytes() if as_bytes else buffer.reshape(-1)), media_type
+
+def draw_result(image, initial_centroids, clustered_centroids, spiral_params, inplace=False):
+    """
+    重心と螺旋を描いた画像を返す。螺旋には向き (chirality) が分かるよう外側の端に矢印を付ける。
+    inplace=True なら複製せずに image に直接描く (呼び出し側が元の画像を使わない場合)
+    """
+    final_image = image if inplace else image.copy()
     
     if initial_centroids is not None and len(initial_centroids) > 0:
         for (cx, cy) in initial_centroids:
@@ -14,12 +78,8 @@ def draw_result(image, initial_centroids, clustered_centroids, spiral_params):
 
     # ★★★ spiral_paramsがNoneでない場合のみ、螺旋を描画 ★★★
     if spiral_params:
-        cx, cy, a, b = spiral_params['cx'], spiral_params['cy'], spiral_params['a'], spiral_params['b']
-        theta_fit = np.linspace(-np.pi * 5, np.pi * 5, 500)
-        r_fit = a * np.exp(b * theta_fit)
-        x_fit = cx + r_fit * np.cos(theta_fit)
-        y_fit = cy + r_fit * np.sin(theta_fit)
-        fit_points = np.vstack((x_fit, y_fit)).T.astype(np.int32)
+        fit_points = spiral_polyline(spiral_params)
         cv2.polylines(final_image, [fit_points], isClosed=False, color=(255, 0, 0), thickness=3)
+        _draw_orientation_arrow(final_image, fit_points, (255, 0, 0), 3)
 
-    return final_image
\ No newline at end of file
+    return final_image
@@ -0,0 +1,132 @@
+# python_server/worker_pool.py
+
+import os
+import queue
+import asyncio
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+
+# --- ワーカープールの設定 (環境変数で変更可能) ---
+# ANALYSIS_WORKERS: 分析を実行するプロセス数。0 ならプロセスを使わずスレッドで実行する
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", os.cpu_count() or 1))
+# ANALYSIS_QUEUE_SIZE: 実行中に加えて待たせておける件数。これを超えたら 429 を返す
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", max(1, ANALYSIS_WORKERS) * 2))
+# ANALYSIS_RETRY_AFTER: 429 のときに Retry-After ヘッダで返す秒数
+ANALYSIS_RETRY_AFTER = int(os.environ.get("ANALYSIS_RETRY_AFTER", 5))
+
+_executor = None
+_manager = None
+_in_flight = 0
+# start() で指定された、各ワーカーの起動時に1回実行する関数
+_warm_up = None
+
+
+class _WorkerHTTPError(Exception):
+    """ワーカー内の HTTPException はそのままではpickleできないので、この形で親プロセスに戻す"""
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code, self.detail = status_code, detail
+
+
+def init_worker(warm_up=None):
+    # 各プロセスが BLAS/OpenCV のスレッドを大量に立てるとコア数を食い合うので、1スレッドに制限する
+    import cv2
+    from threadpoolctl import threadpool_limits
+    cv2.setNumThreads(1)
+    threadpool_limits(1)
+    # 最初の依頼を受ける前に、読み込みと初回実行のコストを済ませておく
+    if warm_up is not None:
+        warm_up()
+
+
+def _call(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except HTTPException as e:
+        raise _WorkerHTTPError(e.status_code, e.detail)
+
+
+def get_executor():
+    """プロセスプールを初回利用時に作る。spawn にしておくと親のスレッド状態を引き継がない"""
+    global _executor
+    if _executor is None and ANALYSIS_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=init_worker, initargs=(_warm_up,))
+    return _executor
+
+
+async def start(warm_up=None):
+    """
+    起動時 (準備完了を報告する前) に呼ぶ。warm_up を渡すとプールをこの時点で作り、各ワーカープロセスの起動時に
+    1回ずつ実行して、少なくとも1つのワーカーで終わるまで待つ。プロセスを使わない設定ならこのプロセスで1回実行する。
+    spawn のプールは空きワーカーが無いと依頼ごとに1プロセス起動するので、ワーカー数と同じ件数を投げて全員を同時に起こす。
+    warm_up が None なら何もしない (プールは従来どおり初回利用時に作る)。
+    """
+    global _warm_up
+    if warm_up is None:
+        return
+    _warm_up = warm_up
+    executor = get_executor()
+    if executor is None:
+        await asyncio.to_thread(warm_up)
+        return
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(ANALYSIS_WORKERS)))
+
+
+def make_progress_channel():
+    """
+    ワーカーから途中経過を受け取るキューと、ワーカーに中断を伝えるイベントを作る。
+    プロセスプールを使う場合はプロセス間で共有できる Manager のキュー・イベントを返す。
+    """
+    global _manager
+    if get_executor() is None:
+        return queue.Queue(), threading.Event()
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    return _manager.Queue(), _manager.Event()
+
+
+def shutdown():
+    global _executor, _manager
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+
+def pool_status():
+    return {"workers": ANALYSIS_WORKERS, "queue_size": ANALYSIS_QUEUE_SIZE, "in_flight": _in_flight}
+
+
+def check_capacity():
+    """実行中 + 待ち行列が上限に達していたら 429 (Retry-After 付き) を送出する"""
+    if _in_flight >= max(1, ANALYSIS_WORKERS) + ANALYSIS_QUEUE_SIZE:
+        raise HTTPException(status_code=429, detail="サーバーが混み合っています。しばらくしてから再試行してください。",
+                            headers={"Retry-After": str(ANALYSIS_RETRY_AFTER)})
+
+
+async def run_in_pool(fn, *args, **kwargs):
+    """
+    CPU を使う処理をイベントループの外 (ワーカープロセス) で実行する。
+    実行中 + 待ち行列が上限に達していたら、積み上げずにすぐ 429 (Retry-After 付き) を返す。
+    """
+    global _in_flight
+    check_capacity()
+    _in_flight += 1
+    try:
+        executor = get_executor()
+        if executor is None:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(_call, fn, args, kwargs))
+    except _WorkerHTTPError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        _in_flight -= 1